@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Propagation kernels benchmark.
+
+Check that the kernels of `sudoku_reader.kernels` give bit-identical results
+with every backend, on generated 4x4 to 25x25 grids (a part of them being
+contradictory), then time them. Exits with an error on the first difference.
+
+Run it from the repository root with each backend:
+
+    python -m benchmarks.kernels
+    SUDOKU_KERNELS=numpy python -m benchmarks.kernels
+
+"""
+import argparse
+import contextlib
+import sys
+import time
+
+import numpy as np
+
+from sudoku_reader import kernels
+
+KERNELS = (
+    "candidate_masks",
+    "eliminate",
+    "unit_digit_counts",
+    "candidate_counts",
+    "find_singles",
+    "propagate",
+)
+
+
+def generate_grids(sizes: tuple, count: int, seed: int = 0) -> list:
+    """
+    Generate grids by emptying 30% to 80% of the cells of shuffled solutions.
+    Every other grid gets an extra random digit, which makes some of them
+    contradictory.
+
+    Returns
+    -------
+    list of (int, np.ndarray)
+        The box size and the int64 map of each grid.
+    """
+    rng = np.random.default_rng(seed)
+    grids = list()
+    for size in sizes:
+        length = size * size
+        rows, columns = np.indices((length, length))
+        pattern = (size * (rows % size) + rows // size + columns) % length
+        for k in range(count):
+            solution = rng.permutation(length)[pattern] + 1
+            sudoku_map = np.where(
+                rng.random((length, length)) < rng.uniform(0.3, 0.8), 0, solution
+            ).astype(np.int64)
+            empty = np.argwhere(sudoku_map == 0)
+            if k % 2 and len(empty):
+                x, y = empty[rng.integers(len(empty))]
+                sudoku_map[x, y] = rng.integers(1, length + 1)
+            grids.append((size, sudoku_map))
+    return grids
+
+
+@contextlib.contextmanager
+def loop_kernels():
+    # The loop kernels call each other through the module names, which are
+    # bound to the loop versions so that no other backend is involved.
+    bound = {name: getattr(kernels, name) for name in KERNELS}
+    try:
+        for name in KERNELS:
+            setattr(kernels, name, getattr(kernels, f"{name}_loops"))
+        yield
+    finally:
+        for name, kernel in bound.items():
+            setattr(kernels, name, kernel)
+
+
+def run_kernels(implementations: dict, size: int, sudoku_map: np.ndarray) -> list:
+    """
+    Run every kernel on a grid.
+
+    Returns
+    -------
+    list
+        The results of the kernels.
+    """
+    masks = implementations["candidate_masks"](sudoku_map, size)
+    eliminated = masks.copy()
+    for x, y in np.argwhere(sudoku_map == 0)[:3]:
+        value = int(np.argmax((eliminated[x, y] >> np.arange(size * size + 1)) & 1))
+        implementations["eliminate"](eliminated, x, y, value, size)
+    current, propagated, consistent = implementations["propagate"](sudoku_map, size)
+    return [
+        masks,
+        eliminated,
+        implementations["unit_digit_counts"](masks, size),
+        implementations["candidate_counts"](masks, size),
+        implementations["find_singles"](masks, size),
+        current,
+        propagated,
+        consistent,
+    ]
+
+
+def compare(expected: list, results: list) -> bool:
+    for first, second in zip(expected, results):
+        if isinstance(first, np.ndarray):
+            if (
+                first.dtype != second.dtype
+                or first.shape != second.shape
+                or not np.array_equal(first, second)
+            ):
+                return False
+        elif bool(first) != bool(second):
+            return False
+    return True
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--count", type=int, default=20, help="grids per size")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    grids = generate_grids((2, 3, 4, 5), args.count, args.seed)
+    numpy_kernels = {name: getattr(kernels, f"{name}_numpy") for name in KERNELS}
+    backend_kernels = {name: getattr(kernels, name) for name in KERNELS}
+    print(f"Backend: {kernels.BACKEND}")
+    # Compiled before the loop kernels are bound to the module names.
+    run_kernels(backend_kernels, *grids[0])
+
+    for size, sudoku_map in grids:
+        expected = run_kernels(numpy_kernels, size, sudoku_map)
+        with loop_kernels():
+            loops = run_kernels(
+                {name: getattr(kernels, name) for name in KERNELS}, size, sudoku_map
+            )
+        for name, results in (
+            ("loops", loops),
+            (kernels.BACKEND, run_kernels(backend_kernels, size, sudoku_map)),
+        ):
+            if not compare(expected, results):
+                print(f"The {name} kernels differ from NumPy on:\n{sudoku_map}")
+                return 1
+    contradictory = sum(
+        not run_kernels(backend_kernels, size, sudoku_map)[-1]
+        for size, sudoku_map in grids
+    )
+    print(
+        f"{len(grids)} grids ({contradictory} contradictory): "
+        "identical results with every backend."
+    )
+
+    for size in (2, 3, 4, 5):
+        maps = [sudoku_map for grid_size, sudoku_map in grids if grid_size == size]
+        start = time.perf_counter()
+        for sudoku_map in maps:
+            kernels.propagate(sudoku_map, size)
+        elapsed = (time.perf_counter() - start) / len(maps)
+        print(f"{size ** 2}x{size ** 2}: propagate in {elapsed * 1000:.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
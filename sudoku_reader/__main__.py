@@ -3,31 +3,19 @@ Main application program.
 """
 import traceback
 import sys
+from collections import deque
 
 from PySide6.QtWidgets import QApplication
-from PySide6.QtCore import Signal, QObject
+from PySide6.QtCore import Signal, QObject, Qt
 import matplotlib.pyplot as plt
 import numpy as np
 
 from sudoku_reader.interfaces import AlgorithmType, Resolver
 from sudoku_reader.gui import MainWindow
-from sudoku_reader.csp import SudokuCSP
-from sudoku_reader.picture import (
-    binarize,
-    binary_dilatation,
-    get_largest_connected_components,
-    get_highest_spikes,
-    filter_digit_pictures,
-    perspective_transform,
-)
-from sudoku_reader.digits import filter_cells, predict_digit_from_picture
-from sudoku_reader.algorithms import (
-    backtracking_search,
-    most_constrained_variable,
-    minimum_remaining_value,
-    least_constraining_value,
-    AC3,
-)
+from sudoku_reader.picture import extract_digit_pictures, filter_cells
+from sudoku_reader.digits import predict_digit_from_picture
+from sudoku_reader.algorithms import SearchProgress, solve_sudoku
+from sudoku_reader.generator import Generator, SudokuDifficulty
 
 
 class SudokuResolver(Resolver):
@@ -37,6 +25,7 @@ class SudokuResolver(Resolver):
 
     result_ready = Signal((AlgorithmType, np.ndarray))
     error = Signal(str)
+    progress = Signal(object)
 
     def do_work(
         self,
@@ -60,29 +49,12 @@ class SudokuResolver(Resolver):
         try:
             algorithm_type = AlgorithmType[algorithm_type.name]
 
-            csp = SudokuCSP(sudoku_map)
-            assignment = None
+            solution = solve_sudoku(
+                sudoku_map, algorithm_type, progress=SearchProgress(self.progress.emit)
+            )
 
-            if algorithm_type is AlgorithmType.BACKTRACKING:
-                assignment = backtracking_search(csp)
-            elif algorithm_type == AlgorithmType.MRV:
-                assignment = backtracking_search(
-                    csp, select_unassigned_variable=minimum_remaining_value
-                )
-            elif algorithm_type == AlgorithmType.DEGREE_H:
-                assignment = backtracking_search(
-                    csp, select_unassigned_variable=most_constrained_variable
-                )
-            elif algorithm_type == AlgorithmType.LEAST_CONSTRAINING_H:
-                assignment = backtracking_search(
-                    csp, order_domain_values=least_constraining_value
-                )
-            elif algorithm_type == AlgorithmType.AC3:
-                csp = AC3(csp)
-                assignment = backtracking_search(csp)
-
-            if assignment is not None:
-                sudoku_map = csp.get_resulted_map(assignment)
+            if solution is not None:
+                sudoku_map = solution
             else:
                 self.error.emit(
                     f"Can't find a solution using {algorithm_type.value} algorithm."
@@ -93,27 +65,114 @@ class SudokuResolver(Resolver):
         self.result_ready.emit(algorithm_type, sudoku_map)
 
 
-class PictureImporter(QObject):
+class PuzzleGenerator(QObject):
+    """
+    A worker who generates the puzzles, keeping a few puzzles of the last
+    asked kind ready in advance.
+    """
 
-    result_ready = Signal(list)
+    result_ready = Signal(np.ndarray)
     error = Signal(str)
+    refill_needed = Signal(object)
 
-    def do_work(self, picture: np.ndarray):
+    def __init__(self, prefetch: int = 3):
+        """
+        Create a PuzzleGenerator instance.
+
+        Parameters
+        ----------
+        prefetch : int, optional
+            Number of puzzles generated in advance.
+        """
+        super().__init__()
+        self.prefetch_count = prefetch
+        self.puzzles = dict()
+        self.current_kind = None
+        # Queued so that a request waits for one generation at most.
+        self.refill_needed.connect(self.refill, Qt.QueuedConnection)
+
+    @staticmethod
+    def generate(kind: tuple) -> np.ndarray:
+        is_online, size, difficulty = kind
+        if is_online:
+            return Generator.generate_online(size, difficulty)
+        return Generator.generate_backtracking(size, difficulty)
+
+    @staticmethod
+    def get_kind(is_online: bool, size: int, difficulty) -> tuple:
+        return is_online, size, SudokuDifficulty[difficulty.name]
+
+    def do_work(self, is_online: bool, size: int, difficulty):
+        """
+        Send a puzzle, a prefetched one if available.
+
+        Parameters
+        ----------
+        is_online : bool
+            Whether the puzzle is generated online.
+        size : int
+            The size of the puzzle.
+        difficulty : SudokuDifficulty
+            The difficulty of the puzzle.
+
+        Returns
+        -------
+        None
+        """
+        kind = self.get_kind(is_online, size, difficulty)
+        self.current_kind = kind
+        puzzles = self.puzzles.setdefault(kind, deque())
         try:
-            print("Trying to import the picture")
-            print(picture)
-            picture = binarize(picture)
+            sudoku_map = puzzles.popleft() if puzzles else self.generate(kind)
+            self.result_ready.emit(sudoku_map)
+        except Exception:
+            print(traceback.format_exc())
+            self.error.emit(traceback.format_exc())
+            return
+        self.refill_needed.emit(kind)
 
-            bin_picture = binary_dilatation(picture)
+    def prefetch(self, is_online: bool, size: int, difficulty):
+        """
+        Start generating puzzles of the given kind in advance.
 
-            bin_picture = perspective_transform(bin_picture)
+        Parameters
+        ----------
+        is_online : bool
+        size : int
+        difficulty : SudokuDifficulty
+
+        Returns
+        -------
+        None
+        """
+        self.current_kind = self.get_kind(is_online, size, difficulty)
+        self.refill_needed.emit(self.current_kind)
+
+    def refill(self, kind: tuple):
+        # Generate one puzzle at a time, so that requests are served between.
+        if kind != self.current_kind:
+            return
+        puzzles = self.puzzles.setdefault(kind, deque())
+        if len(puzzles) >= self.prefetch_count:
+            return
+        try:
+            puzzles.append(self.generate(kind))
+        except Exception:
+            print(traceback.format_exc())
+            return
+        self.refill_needed.emit(kind)
 
-            grid_picture = get_largest_connected_components(bin_picture)
 
-            x_proj = get_highest_spikes(grid_picture, n=10, axis=0)
-            y_proj = get_highest_spikes(grid_picture, n=10, axis=1)
+class PictureImporter(QObject):
 
-            digits = filter_digit_pictures(bin_picture, y_proj, x_proj)
+    result_ready = Signal(list)
+    error = Signal(str)
+
+    def do_work(self, picture: np.ndarray):
+        try:
+            print("Trying to import the picture")
+            print(picture)
+            digits = extract_digit_pictures(picture)
 
             digits = filter_cells(digits)
             print(digits[0][1])
@@ -135,7 +194,10 @@ if __name__ == "__main__":
 
     sudoku_solver = SudokuResolver()
     picture_importer = PictureImporter()
-    main_window = MainWindow("Sudoku solver", sudoku_solver, picture_importer)
+    puzzle_generator = PuzzleGenerator()
+    main_window = MainWindow(
+        "Sudoku solver", sudoku_solver, picture_importer, puzzle_generator
+    )
     main_window.resize(1000, 700)
     main_window.show()
 
@@ -2,10 +2,221 @@
 """Solver algorithms.
 
 """
+import heapq
+import itertools
+import math
+import time
+from collections import OrderedDict
+
 import numpy as np
 
-from sudoku_reader.csp import CSP
-from sudoku_reader.interfaces import Constraint
+from sudoku_reader.csp import CSP, SudokuCSP, is_consistent_map
+from sudoku_reader.interfaces import AlgorithmType, Constraint
+from sudoku_reader.kernels import candidate_counts, propagate
+from sudoku_reader.metrics import Trace
+
+
+class SearchStatistics:
+    """
+    Counters filled by a search.
+    """
+
+    def __init__(self):
+        self.nodes = 0
+        self.backtracks = 0
+        self.backjumps = 0
+        self.restarts = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "nodes": self.nodes,
+            "backtracks": self.backtracks,
+            "backjumps": self.backjumps,
+            "restarts": self.restarts,
+        }
+
+
+class SearchCutoff(Exception):
+    """
+    Raised when a search reaches its maximum number of backtracks.
+    """
+
+
+def luby(i: int) -> int:
+    """
+    Get the i-th term of the Luby sequence: 1, 1, 2, 1, 1, 2, 4, 1, 1, 2, ...
+
+    Parameters
+    ----------
+    i : int
+        A positive index.
+
+    Returns
+    -------
+    int
+    """
+    while True:
+        k = i.bit_length()
+        if i == (1 << k) - 1:
+            return 1 << (k - 1)
+        i -= (1 << (k - 1)) - 1
+
+
+def restart_cutoffs(strategy: str = "luby", base: int = 100, factor: float = 1.5):
+    """
+    Generate the backtrack cutoffs of the successive runs of a restarting
+    search.
+
+    Parameters
+    ----------
+    strategy : str, optional
+        "luby" for `base` times the Luby sequence, "geometric" for a cutoff
+        multiplied by `factor` at each restart.
+    base : int, optional
+        Cutoff of the first run.
+    factor : float, optional
+
+    Returns
+    -------
+    Generator of int
+    """
+    if strategy not in ("luby", "geometric"):
+        raise ValueError(f"Unknown restart strategy {strategy}.")
+    i = 1
+    while True:
+        if strategy == "luby":
+            yield base * luby(i)
+        else:
+            yield round(base * factor ** (i - 1))
+        i += 1
+
+
+class SearchProgress:
+    """
+    Snapshots of a running search, sent at most `rate` times per second.
+    """
+
+    def __init__(self, callback: callable, rate: float = 25.0):
+        """
+        Create a SearchProgress instance.
+
+        Parameters
+        ----------
+        callback : callable
+            Called with each snapshot, a dictionary with the current partial
+            assignment, the partial sudoku map (for a SudokuCSP), the number
+            of explored nodes, the nodes per second, the depth of the search
+            and the elapsed time.
+        rate : float, optional
+            Maximum number of snapshots per second.
+        """
+        self.callback = callback
+        self.interval = 1 / rate
+        self.csp = None
+        self.nodes = 0
+        self.base_depth = 0
+        self.started_at = self.next_snapshot_at = time.perf_counter()
+
+    def start(self, csp: CSP, assignment: dict):
+        self.csp = csp
+        self.nodes = 0
+        self.base_depth = len(assignment)
+        self.started_at = time.perf_counter()
+        self.next_snapshot_at = self.started_at + self.interval
+
+    def update(self, assignment: dict):
+        """
+        Count a node and send a snapshot if the last one is old enough.
+
+        Parameters
+        ----------
+        assignment : dict
+
+        Returns
+        -------
+        None
+        """
+        self.nodes += 1
+        now = time.perf_counter()
+        if now < self.next_snapshot_at:
+            return
+        self.next_snapshot_at = now + self.interval
+
+        elapsed = now - self.started_at
+        sudoku_map = None
+        if isinstance(self.csp, SudokuCSP):
+            sudoku_map = self.csp.get_partial_map(assignment)
+        self.callback(
+            {
+                "assignment": dict(assignment),
+                "sudoku_map": sudoku_map,
+                "nodes": self.nodes,
+                "nodes_per_second": self.nodes / elapsed if elapsed else 0.0,
+                "depth": len(assignment) - self.base_depth,
+                "elapsed": elapsed,
+            }
+        )
+
+
+class NogoodStore:
+    """
+    A bounded set of nogoods, partial assignments known to have no solution.
+    The oldest nogoods are forgotten first.
+    """
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max_size
+        self.nogoods = OrderedDict()
+        self.index = dict()
+
+    def __len__(self) -> int:
+        return len(self.nogoods)
+
+    def add(self, nogood: frozenset):
+        """
+        Record a nogood.
+
+        Parameters
+        ----------
+        nogood : frozenset
+            (variable, value) pairs.
+
+        Returns
+        -------
+        None
+        """
+        if nogood in self.nogoods:
+            self.nogoods.move_to_end(nogood)
+            return
+        self.nogoods[nogood] = None
+        for pair in nogood:
+            self.index.setdefault(pair, set()).add(nogood)
+        if len(self.nogoods) > self.max_size:
+            oldest, _ = self.nogoods.popitem(last=False)
+            for pair in oldest:
+                self.index[pair].discard(oldest)
+
+    def violated(self, assignment: dict, var: any, value: any) -> frozenset:
+        """
+        Find a nogood completed by a new assignment.
+
+        Parameters
+        ----------
+        assignment : dict
+        var : any
+        value : any
+
+        Returns
+        -------
+        frozenset or None
+        """
+        for nogood in self.index.get((var, value), ()):
+            if all(
+                other == var or other in assignment and assignment[other] == x
+                for other, x in nogood
+            ):
+                return nogood
+        return None
 
 
 def unorder_domain_values(var: any, assignment: dict, csp: CSP):
@@ -67,9 +278,9 @@ def legal_values_count(csp: CSP, assignment, var):
     var_domain = csp.domains[var].copy()
     for val in csp.domains[var]:
         for constraint in related_constraints:
-            if all(v in assignment for v in constraint.scope):
+            if all(v in assignment or v == var for v in constraint.scope):
                 if not constraint.satisfied(assignment | {var: val}):
-                    var_domain.remove(val)
+                    var_domain.discard(val)
     return len(var_domain)
 
 
@@ -85,6 +296,306 @@ def minimum_remaining_value(assignment, csp: CSP):
     return selected_var
 
 
+class IncrementalHeuristic:
+    """
+    Base of the heuristics following the assignment of a search from one call
+    to the next.
+
+    The search undoes its assignments in the reverse order and adds the new
+    ones at the end of the dictionary, so the changes since the previous call
+    are found without comparing the whole assignment. The constraints must
+    forbid equal values, as in SudokuCSP: a value is a candidate of a
+    variable while it is in its domain and no neighbour has it. Subclasses
+    build their counters in the `start` method and update them in the
+    `assigned_variable`, `unassigned_variable`, `restricted` and `relaxed`
+    methods.
+    """
+
+    def __init__(self):
+        self.csp = None
+        self.order = None
+        self.assignment = None
+
+    def follow(self, assignment: dict, csp: CSP):
+        """
+        Apply the changes of the assignment since the previous call.
+
+        Parameters
+        ----------
+        assignment : dict
+        csp : CSP
+
+        Returns
+        -------
+        None
+        """
+        if csp is not self.csp:
+            self.prepare(csp)
+        if (
+            assignment is not self.assignment
+            or csp.variables is not self.order
+            or not self.update(assignment)
+        ):
+            self.reset(assignment, csp)
+
+    def prepare(self, csp: CSP):
+        # The neighbours are computed once per CSP.
+        self.csp = csp
+        self.variables = list(csp.variables)
+        self.index = {var: i for i, var in enumerate(self.variables)}
+        self.neighbours = [
+            [self.index[other] for other in set(csp.neighbour(var))]
+            for var in self.variables
+        ]
+
+    def reset(self, assignment: dict, csp: CSP):
+        self.assignment = assignment
+        self.order = csp.variables
+        self.domains = [csp.domains[var] for var in self.variables]
+        self.taken = [dict() for _ in self.variables]
+        self.assigned = [False] * len(self.variables)
+        self.stack = list()
+        self.start(csp)
+        for var, value in assignment.items():
+            self.assign(self.index[var], value)
+
+    def update(self, assignment: dict) -> bool:
+        """
+        Returns
+        -------
+        bool
+            False if the changes don't follow the order of a search.
+        """
+        stack = self.stack
+        while stack:
+            i, value = stack[-1]
+            var = self.variables[i]
+            if var in assignment and assignment[var] == value:
+                break
+            self.unassign(i, value)
+
+        added = len(assignment) - len(stack)
+        if added < 0:
+            return False
+        for var in reversed(list(itertools.islice(reversed(assignment), added))):
+            self.assign(self.index[var], assignment[var])
+        return not stack or self.variables[stack[-1][0]] == next(reversed(assignment))
+
+    def is_candidate(self, i: int, value: any) -> bool:
+        return value in self.domains[i] and not self.taken[i].get(value)
+
+    def assign(self, i: int, value: any):
+        self.assigned[i] = True
+        self.stack.append((i, value))
+        self.assigned_variable(i, value)
+        for j in self.neighbours[i]:
+            count = self.taken[j].get(value, 0)
+            self.taken[j][value] = count + 1
+            self.restricted(j, value, not count and value in self.domains[j])
+
+    def unassign(self, i: int, value: any):
+        self.assigned[i] = False
+        self.stack.pop()
+        for j in self.neighbours[i]:
+            count = self.taken[j][value] - 1
+            self.taken[j][value] = count
+            self.relaxed(j, value, not count and value in self.domains[j])
+        self.unassigned_variable(i, value)
+
+    def start(self, csp: CSP):
+        pass
+
+    def assigned_variable(self, i: int, value: any):
+        pass
+
+    def unassigned_variable(self, i: int, value: any):
+        pass
+
+    def restricted(self, j: int, value: any, removed: bool):
+        pass
+
+    def relaxed(self, j: int, value: any, restored: bool):
+        pass
+
+
+class ConstrainedVariableSelector(IncrementalHeuristic):
+    """
+    Select the unassigned variable with the fewest legal values, the ties
+    being broken by the most unassigned neighbours (dynamic degree), then by
+    the order of the variables.
+
+    The legal values and unassigned neighbours counts are updated from the
+    assignments made or undone since the previous call, and the variables are
+    kept in a heap, so that a selection costs O(log n) instead of a scan of
+    all the variables.
+    """
+
+    def __call__(self, assignment: dict, csp: CSP):
+        """
+        Get the next variable to assign.
+
+        Parameters
+        ----------
+        assignment : dict
+        csp : CSP
+
+        Returns
+        -------
+        any
+        """
+        self.follow(assignment, csp)
+
+        heap = self.heap
+        while True:
+            remaining, degree, _, i = heap[0]
+            if (
+                not self.assigned[i]
+                and remaining == self.remaining[i]
+                and -degree == self.degrees[i]
+            ):
+                return self.variables[i]
+            heapq.heappop(heap)
+
+    def prepare(self, csp: CSP):
+        super().prepare(csp)
+        self.static_degrees = [len(neighbours) for neighbours in self.neighbours]
+
+    def reset(self, assignment: dict, csp: CSP):
+        super().reset(assignment, csp)
+        self.rebuild()
+
+    def start(self, csp: CSP):
+        self.rank = [0] * len(self.variables)
+        for rank, var in enumerate(csp.variables):
+            self.rank[self.index[var]] = rank
+        self.remaining = [len(domain) for domain in self.domains]
+        self.degrees = list(self.static_degrees)
+        self.heap = list()
+
+    def unassigned_variable(self, i: int, value: any):
+        self.push(i)
+
+    def restricted(self, j: int, value: any, removed: bool):
+        self.degrees[j] -= 1
+        if removed:
+            self.remaining[j] -= 1
+        if not self.assigned[j]:
+            self.push(j)
+
+    def relaxed(self, j: int, value: any, restored: bool):
+        self.degrees[j] += 1
+        if restored:
+            self.remaining[j] += 1
+        if not self.assigned[j]:
+            self.push(j)
+
+    def push(self, i: int):
+        # Outdated entries are skipped when selecting, and dropped when the
+        # heap grows too large.
+        if len(self.heap) > 4 * len(self.variables):
+            self.rebuild()
+        heapq.heappush(
+            self.heap, (self.remaining[i], -self.degrees[i], self.rank[i], i)
+        )
+
+    def rebuild(self):
+        self.heap = [
+            (self.remaining[i], -self.degrees[i], self.rank[i], i)
+            for i in range(len(self.variables))
+            if not self.assigned[i]
+        ]
+        heapq.heapify(self.heap)
+
+
+class LeastConstrainingValueOrder(IncrementalHeuristic):
+    """
+    Sort the values of a variable by the number of unassigned neighbours
+    having them as candidate, the least constraining first.
+
+    The candidates of the unassigned cells are counted per digit in each row,
+    column, box, and row and column segment (intersection of a box with a row
+    or a column), so that the neighbours of a cell having a digit are
+    row + column + box - row segment - column segment - the cell itself,
+    a few lookups per value. Only for SudokuCSP.
+    """
+
+    def __call__(self, var: any, assignment: dict, csp: SudokuCSP):
+        """
+        Sort the values of the given variable domain.
+
+        Parameters
+        ----------
+        var : any
+        assignment : dict
+        csp : SudokuCSP
+
+        Returns
+        -------
+        List[any]
+        """
+        self.follow(assignment, csp)
+
+        i = self.index[var]
+        counts = self.counts
+        row, column, box, row_segment, column_segment = self.units[i]
+
+        def constrained_count(value):
+            return (
+                counts[row][value]
+                + counts[column][value]
+                + counts[box][value]
+                - counts[row_segment][value]
+                - counts[column_segment][value]
+                - self.is_candidate(i, value)
+            )
+
+        return sorted(csp.domains[var], key=constrained_count)
+
+    def prepare(self, csp: SudokuCSP):
+        super().prepare(csp)
+        length = len(csp.sudoku_map)
+        size = math.isqrt(length)
+        self.units = [None] * len(self.variables)
+        for x in range(length):
+            for y in range(length):
+                self.units[self.index[f"{x}, {y}"]] = (
+                    x,
+                    length + y,
+                    2 * length + size * (x // size) + y // size,
+                    3 * length + size * x + y // size,
+                    (3 + size) * length + size * y + x // size,
+                )
+        self.unit_count = (3 + 2 * size) * length
+        self.length = length
+
+    def start(self, csp: SudokuCSP):
+        self.counts = [[0] * (self.length + 1) for _ in range(self.unit_count)]
+        for i in range(len(self.variables)):
+            self.count_candidates(i, 1)
+
+    def count_candidates(self, i: int, step: int):
+        for value in self.domains[i]:
+            if not self.taken[i].get(value):
+                for unit in self.units[i]:
+                    self.counts[unit][value] += step
+
+    def assigned_variable(self, i: int, value: any):
+        self.count_candidates(i, -1)
+
+    def unassigned_variable(self, i: int, value: any):
+        self.count_candidates(i, 1)
+
+    def restricted(self, j: int, value: any, removed: bool):
+        if removed and not self.assigned[j]:
+            for unit in self.units[j]:
+                self.counts[unit][value] -= 1
+
+    def relaxed(self, j: int, value: any, restored: bool):
+        if restored and not self.assigned[j]:
+            for unit in self.units[j]:
+                self.counts[unit][value] += 1
+
+
 def AC3(csp: CSP) -> CSP:
     def remove_inconsistent_values(v, associated_constraint: Constraint) -> bool:
         removed = False
@@ -115,12 +626,11 @@ def AC3(csp: CSP) -> CSP:
 
 
 def most_constrained_variable(assignment: dict, csp: CSP):
-    unassigned_variables = set(csp.variables).symmetric_difference(
-        set(assignment.keys())
-    )
-
+    # Ties are broken by the order of the variables, shuffled by restarts.
     unassigned_var_to_const = {
-        k: csp.var_to_const[k] for k in unassigned_variables if k in csp.var_to_const
+        k: csp.var_to_const[k]
+        for k in csp.variables
+        if k not in assignment and k in csp.var_to_const
     }
 
     return sorted(unassigned_var_to_const, key=len)[0]
@@ -172,6 +682,13 @@ def backtracking_search(
     csp: CSP,
     select_unassigned_variable=first_unassigned_variable,
     order_domain_values=unorder_domain_values,
+    statistics: SearchStatistics = None,
+    progress: SearchProgress = None,
+    backjumping: bool = False,
+    max_nogoods: int = 0,
+    restarts: str = None,
+    restart_base: int = 100,
+    seed: int = None,
 ):
     """
     Implementation of the backtracking search algorithm.
@@ -184,14 +701,77 @@ def backtracking_search(
         How the variables are sorted.
     order_domain_values : callable
         How the domain ise sorted.
+    statistics : SearchStatistics, optional
+        Counters to fill during the search.
+    progress : SearchProgress, optional
+        Receives snapshots of the search.
+    backjumping : bool, optional
+        Use conflict-directed backjumping instead of chronological
+        backtracking.
+    max_nogoods : int, optional
+        Maximum number of nogoods learned during a backjumping search. They
+        are kept across restarts.
+    restarts : str, optional
+        Restart the search with the variables in a new random order each time
+        it reaches a number of backtracks given by a "luby" or "geometric"
+        cutoff sequence (see `restart_cutoffs`). The ties of the variable
+        selection heuristics are then broken at random.
+    restart_base : int, optional
+        Backtrack cutoff of the first run.
+    seed : int, optional
+        Seed of the random orders of a restarting search.
 
     Returns
     -------
     dict
     """
-    return recursive_backtracking(
-        csp.apply_constraints(), csp, select_unassigned_variable, order_domain_values
-    )
+    assignment = csp.apply_constraints()
+    if progress is not None:
+        progress.start(csp, assignment)
+    if max_nogoods and not backjumping:
+        raise ValueError("Nogoods are only learned by a backjumping search.")
+    nogoods = NogoodStore(max_nogoods) if max_nogoods else None
+
+    def search(max_backtracks: int = None):
+        if backjumping:
+            result, _ = conflict_directed_backjumping(
+                dict(assignment),
+                csp,
+                select_unassigned_variable,
+                order_domain_values,
+                set(assignment),
+                nogoods,
+                statistics,
+                progress,
+                max_backtracks,
+            )
+            return result
+        return recursive_backtracking(
+            dict(assignment),
+            csp,
+            select_unassigned_variable,
+            order_domain_values,
+            statistics,
+            progress,
+            max_backtracks,
+        )
+
+    if restarts is None:
+        return search()
+
+    statistics = statistics if statistics is not None else SearchStatistics()
+    rng = np.random.default_rng(seed)
+    variables = csp.variables
+    try:
+        for cutoff in restart_cutoffs(restarts, restart_base):
+            csp.variables = list(variables)
+            rng.shuffle(csp.variables)
+            try:
+                return search(statistics.backtracks + cutoff)
+            except SearchCutoff:
+                statistics.restarts += 1
+    finally:
+        csp.variables = variables
 
 
 def recursive_backtracking(
@@ -199,6 +779,9 @@ def recursive_backtracking(
     csp: CSP,
     select_unassigned_variable=first_unassigned_variable,
     order_domain_values=unorder_domain_values,
+    statistics: SearchStatistics = None,
+    progress: SearchProgress = None,
+    max_backtracks: int = None,
 ):
     """
     Recursive backtracking function.
@@ -213,6 +796,13 @@ def recursive_backtracking(
         How the variables are sorted.
     order_domain_values : callable
         How the domain ise sorted.
+    statistics : SearchStatistics, optional
+        Counters to fill during the search.
+    progress : SearchProgress, optional
+        Receives snapshots of the search.
+    max_backtracks : int, optional
+        Number of backtracks of `statistics` beyond which SearchCutoff is
+        raised.
 
     Returns
     -------
@@ -226,13 +816,464 @@ def recursive_backtracking(
     for value in order_domain_values(var, assignment, csp):
         if csp.consistent_with(assignment, {var: value}):
             assignment[var] = value
+            if statistics is not None:
+                statistics.nodes += 1
+            if progress is not None:
+                progress.update(assignment)
             result = recursive_backtracking(
                 assignment,
                 csp,
                 select_unassigned_variable=select_unassigned_variable,
                 order_domain_values=order_domain_values,
+                statistics=statistics,
+                progress=progress,
+                max_backtracks=max_backtracks,
             )
             if result is not None:
                 return result
             assignment.pop(var)
+            if statistics is not None:
+                statistics.backtracks += 1
+                if (
+                    max_backtracks is not None
+                    and statistics.backtracks > max_backtracks
+                ):
+                    raise SearchCutoff()
     return None
+
+
+def count_solutions(
+    csp: CSP,
+    select_unassigned_variable=first_unassigned_variable,
+    order_domain_values=unorder_domain_values,
+    statistics: SearchStatistics = None,
+    assignment: dict = None,
+) -> int:
+    """
+    Count the solutions of a CSP with a backtracking search.
+
+    Parameters
+    ----------
+    csp : CSP
+        The constraint satisfaction problem.
+    select_unassigned_variable : callable
+        How the variables are sorted.
+    order_domain_values : callable
+        How the domain is sorted.
+    statistics : SearchStatistics, optional
+        Counters to fill during the search.
+    assignment : dict, optional
+        Assignments the search starts from. Defaults to the variables with a
+        single value.
+
+    Returns
+    -------
+    int
+    """
+    if assignment is None:
+        assignment = csp.apply_constraints()
+    assignment = dict(assignment)
+
+    def count() -> int:
+        if len(assignment) == len(csp.variables):
+            return 1
+
+        var = select_unassigned_variable(assignment, csp)
+        solutions = 0
+        for value in order_domain_values(var, assignment, csp):
+            if not csp.conflicts(assignment, var, value):
+                assignment[var] = value
+                if statistics is not None:
+                    statistics.nodes += 1
+                solutions += count()
+                assignment.pop(var)
+                if statistics is not None:
+                    statistics.backtracks += 1
+        return solutions
+
+    return count()
+
+
+def conflict_directed_backjumping(
+    assignment: dict,
+    csp: CSP,
+    select_unassigned_variable=first_unassigned_variable,
+    order_domain_values=unorder_domain_values,
+    fixed: set = frozenset(),
+    nogoods: NogoodStore = None,
+    statistics: SearchStatistics = None,
+    progress: SearchProgress = None,
+    max_backtracks: int = None,
+) -> tuple:
+    """
+    Recursive conflict-directed backjumping function.
+
+    The conflict set of a variable gathers the assigned variables that ruled
+    out its values. When all its values are ruled out, the search jumps back
+    to the most recent variable of its conflict set, skipping the variables
+    that took no part in the failure.
+
+    Parameters
+    ----------
+    assignment : dict
+        Assignments of variables.
+    csp : CSP
+        The constraint satisfaction problem.
+    select_unassigned_variable : callable
+        How the variables are sorted.
+    order_domain_values : callable
+        How the domain ise sorted.
+    fixed : set, optional
+        Variables assigned before the search, never part of a conflict.
+    nogoods : NogoodStore, optional
+        Receives the conflict sets of the failures as nogoods, which prune
+        the search when they appear again.
+    statistics : SearchStatistics, optional
+        Counters to fill during the search.
+    progress : SearchProgress, optional
+        Receives snapshots of the search.
+    max_backtracks : int, optional
+        Number of backtracks of `statistics` beyond which SearchCutoff is
+        raised.
+
+    Returns
+    -------
+    tuple of (dict, set)
+        The complete assignment, or None and the conflict set of the failure.
+    """
+    if len(assignment) == len(csp.variables):
+        return assignment, set()
+
+    var = select_unassigned_variable(assignment, csp)
+    conflict = set()
+
+    for value in order_domain_values(var, assignment, csp):
+        culprits = csp.conflicts(assignment, var, value)
+        if not culprits and nogoods is not None:
+            nogood = nogoods.violated(assignment, var, value)
+            if nogood is not None:
+                culprits = {other for other, _ in nogood if other != var}
+        if culprits:
+            conflict |= culprits - fixed
+            continue
+
+        assignment[var] = value
+        if statistics is not None:
+            statistics.nodes += 1
+        if progress is not None:
+            progress.update(assignment)
+        result, child_conflict = conflict_directed_backjumping(
+            assignment,
+            csp,
+            select_unassigned_variable=select_unassigned_variable,
+            order_domain_values=order_domain_values,
+            fixed=fixed,
+            nogoods=nogoods,
+            statistics=statistics,
+            progress=progress,
+            max_backtracks=max_backtracks,
+        )
+        if result is not None:
+            return result, set()
+        assignment.pop(var)
+        if statistics is not None:
+            statistics.backtracks += 1
+            if max_backtracks is not None and statistics.backtracks > max_backtracks:
+                raise SearchCutoff()
+
+        if var not in child_conflict:
+            # The failure doesn't depend on this variable: jump over it.
+            if statistics is not None:
+                statistics.backjumps += 1
+            return None, child_conflict
+        conflict |= child_conflict - {var}
+
+    if nogoods is not None and conflict:
+        nogoods.add(frozenset((other, assignment[other]) for other in conflict))
+    return None, conflict
+
+
+def propagation_search(
+    sudoku_map: np.ndarray,
+    statistics: SearchStatistics = None,
+    progress: SearchProgress = None,
+) -> np.ndarray:
+    """
+    Depth-first search on sudoku maps, propagating the naked and hidden
+    singles at each node with the kernels of `sudoku_reader.kernels`, and
+    branching on the empty cell with the fewest candidates.
+
+    Parameters
+    ----------
+    sudoku_map : np.ndarray
+        A N x N array (empty => 0).
+    statistics : SearchStatistics, optional
+        Counters to fill during the search.
+    progress : SearchProgress, optional
+        Receives snapshots of the search.
+
+    Returns
+    -------
+    np.ndarray or None if the map has no solution.
+    """
+    length = len(sudoku_map)
+    size = math.isqrt(length)
+
+    def get_assignment(current):
+        return {
+            f"{x}, {y}": value for (x, y), value in np.ndenumerate(current) if value
+        }
+
+    if progress is not None:
+        progress.start(SudokuCSP(sudoku_map), get_assignment(sudoku_map))
+
+    def search(current):
+        current, masks, consistent = propagate(current, size)
+        if not consistent:
+            return None
+        if current.all():
+            return current
+
+        counts = np.where(current == 0, candidate_counts(masks, size), length + 1)
+        x, y = np.unravel_index(np.argmin(counts), counts.shape)
+        for value in range(1, length + 1):
+            if (masks[x, y] >> value) & 1:
+                child = current.copy()
+                child[x, y] = value
+                if statistics is not None:
+                    statistics.nodes += 1
+                if progress is not None:
+                    progress.update(get_assignment(child))
+                result = search(child)
+                if result is not None:
+                    return result
+                if statistics is not None:
+                    statistics.backtracks += 1
+        return None
+
+    result = search(np.asarray(sudoku_map, dtype=np.int64))
+    return result.astype(sudoku_map.dtype) if result is not None else None
+
+
+def solve_sudoku(
+    sudoku_map: np.ndarray,
+    algorithm_type: AlgorithmType = AlgorithmType.BACKTRACKING,
+    statistics: SearchStatistics = None,
+    progress: SearchProgress = None,
+    **kwargs,
+):
+    """
+    Solve a sudoku map using the chosen algorithm.
+
+    Parameters
+    ----------
+    sudoku_map : np.ndarray
+        A N x N array (empty => 0).
+    algorithm_type : AlgorithmType, optional
+    statistics : SearchStatistics, optional
+        Counters to fill during the search.
+    progress : SearchProgress, optional
+        Receives snapshots of the search, except for the portfolio.
+    kwargs
+        Passed to `backtracking_search`, e.g. `backjumping=True` or the `seed`
+        of MRV_RESTARTS, a backjumping search restarted on a Luby sequence.
+        The portfolio, SAT and propagation strategies don't take them.
+
+    Returns
+    -------
+    np.ndarray or None if the map has no solution.
+    """
+    if not is_consistent_map(sudoku_map):
+        return None
+
+    if kwargs and algorithm_type in (
+        AlgorithmType.PORTFOLIO,
+        AlgorithmType.SAT,
+        AlgorithmType.PROPAGATION,
+    ):
+        raise ValueError(f"The {algorithm_type.value} strategy has no options.")
+
+    if algorithm_type is AlgorithmType.PORTFOLIO:
+        # Imported here as the portfolio runs this function in each process.
+        from sudoku_reader.portfolio import solve_portfolio
+
+        solution, _, portfolio_statistics = solve_portfolio(sudoku_map)
+        if statistics is not None:
+            for name, value in portfolio_statistics.items():
+                setattr(statistics, name, value)
+        return solution
+
+    if algorithm_type is AlgorithmType.PROPAGATION:
+        return propagation_search(sudoku_map, statistics, progress)
+
+    csp = SudokuCSP(sudoku_map)
+    assignment = None
+    options = dict(statistics=statistics, progress=progress, **kwargs)
+
+    if algorithm_type is AlgorithmType.BACKTRACKING:
+        assignment = backtracking_search(csp, **options)
+    elif algorithm_type is AlgorithmType.MRV:
+        assignment = backtracking_search(
+            csp, select_unassigned_variable=minimum_remaining_value, **options
+        )
+    elif algorithm_type is AlgorithmType.MRV_DEGREE:
+        assignment = backtracking_search(
+            csp, select_unassigned_variable=ConstrainedVariableSelector(), **options
+        )
+    elif algorithm_type is AlgorithmType.MRV_RESTARTS:
+        options = dict(backjumping=True, restarts="luby") | options
+        assignment = backtracking_search(
+            csp, select_unassigned_variable=minimum_remaining_value, **options
+        )
+    elif algorithm_type is AlgorithmType.DEGREE_H:
+        assignment = backtracking_search(
+            csp, select_unassigned_variable=most_constrained_variable, **options
+        )
+    elif algorithm_type is AlgorithmType.LEAST_CONSTRAINING_H:
+        assignment = backtracking_search(
+            csp, order_domain_values=LeastConstrainingValueOrder(), **options
+        )
+    elif algorithm_type is AlgorithmType.AC3:
+        csp = AC3(csp)
+        assignment = backtracking_search(csp, **options)
+    elif algorithm_type is AlgorithmType.SAT:
+        # Imported here as the SAT solver uses the restarts of this module.
+        from sudoku_reader.sat import solve_sat
+
+        assignment = solve_sat(csp, statistics, progress)
+
+    if assignment is None:
+        return None
+    return csp.get_resulted_map(assignment)
+
+
+def most_probable_grids(
+    probabilities: list,
+    length: int = 9,
+    threshold: float = 0.9,
+    top_k: int = 3,
+    max_cells: int = 6,
+):
+    """
+    Generate the possible grids by decreasing joint probability.
+
+    Only the `max_cells` least confident cells whose best probability is below
+    `threshold` get alternatives, each among its `top_k` most probable digits.
+
+    Parameters
+    ----------
+    probabilities : array of ((x, y), vector of the digit probabilities)
+    length : int, optional
+        Length of the grid side.
+    threshold : float, optional
+    top_k : int, optional
+    max_cells : int, optional
+
+    Returns
+    -------
+    Generator of np.ndarray
+    """
+    base_map = np.zeros((length, length), dtype=int)
+    for position, probs in probabilities:
+        base_map[tuple(position)] = np.argmax(probs)
+
+    uncertain = sorted(
+        (
+            (np.max(probs), tuple(position), np.asarray(probs))
+            for position, probs in probabilities
+            if np.max(probs) < threshold
+        ),
+        key=lambda cell: cell[0],
+    )[:max_cells]
+
+    positions = [position for _, position, _ in uncertain]
+    alternatives = [np.argsort(probs)[::-1][:top_k] for _, _, probs in uncertain]
+    costs = [
+        -np.log(np.maximum(probs[alts], 1e-12))
+        for (_, _, probs), alts in zip(uncertain, alternatives)
+    ]
+
+    def cost(indexes):
+        return sum(costs[c][i] for c, i in enumerate(indexes))
+
+    # Each tuple of indexes is only reached from the one obtained by
+    # decrementing its last non-zero index, so no grid is generated twice.
+    start = (0,) * len(uncertain)
+    heap = [(cost(start), start)]
+    while heap:
+        _, indexes = heapq.heappop(heap)
+
+        sudoku_map = base_map.copy()
+        for c, i in enumerate(indexes):
+            sudoku_map[positions[c]] = alternatives[c][i]
+        yield sudoku_map
+
+        last = max((c for c, i in enumerate(indexes) if i), default=0)
+        for c in range(last, len(indexes)):
+            if indexes[c] + 1 < len(alternatives[c]):
+                successor = indexes[:c] + (indexes[c] + 1,) + indexes[c + 1 :]
+                heapq.heappush(heap, (cost(successor), successor))
+
+
+def solve_most_probable_grid(
+    probabilities: list, length: int = 9, max_attempts: int = 20, **kwargs
+) -> tuple:
+    """
+    Solve the most probable grid that has a solution.
+
+    Parameters
+    ----------
+    probabilities : array of ((x, y), vector of the digit probabilities)
+    length : int, optional
+        Length of the grid side.
+    max_attempts : int, optional
+        Maximum number of grids to try.
+    kwargs
+        Passed to `most_probable_grids`.
+
+    Returns
+    -------
+    tuple of (np.ndarray, np.ndarray)
+        The read grid and its solution. If no solution is found, the most
+        probable grid and None.
+    """
+    most_probable_map = None
+    for attempt, sudoku_map in enumerate(
+        most_probable_grids(probabilities, length, **kwargs)
+    ):
+        if attempt >= max_attempts:
+            break
+        if most_probable_map is None:
+            most_probable_map = sudoku_map
+        if not is_consistent_map(sudoku_map):
+            continue
+
+        # A misread grid can have no solution: the clause learning proves it
+        # quickly, where a backtracking search can take exponential time.
+        solution = solve_sudoku(sudoku_map, AlgorithmType.SAT)
+        if solution is not None:
+            return sudoku_map, solution
+
+    return most_probable_map, None
+
+
+def solve_cells(probabilities: list) -> tuple:
+    """
+    Solve the most probable grid given the digit probabilities of the cells.
+
+    Parameters
+    ----------
+    probabilities : array of ((x, y), vector of the digit probabilities)
+
+    Returns
+    -------
+    tuple of (list of int, bool, list of stage timings)
+        The flatten solution, or the flatten grid if it has no solution,
+        whether it is solved and the stage timings.
+    """
+    trace = Trace()
+    with trace.stage("solve"):
+        grid, solution = solve_most_probable_grid(probabilities)
+    if solution is None:
+        return grid.flatten().tolist(), False, trace.stages
+    return solution.flatten().tolist(), True, trace.stages
@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+"""Command-line batch mode.
+
+Read and solve every puzzle picture of a directory, a glob pattern or an
+archive, or every grid of a text, CSV or puzzle file, in parallel, and write
+the results to a CSV or JSONL file. Already processed puzzles found in the
+output file are skipped, so an interrupted run can be resumed. Grid files are
+streamed, so they are solved with a constant memory usage whatever their size.
+
+Example:
+    python -m sudoku_reader.cli "scans/*.jpg" results.csv --jobs 4
+
+"""
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from sudoku_reader.algorithms import solve_most_probable_grid
+from sudoku_reader.interfaces import AlgorithmType
+from sudoku_reader.portfolio import PORTFOLIO
+from sudoku_reader.puzzles import format_grid, read_puzzles
+from sudoku_reader.stream import solve_stream
+
+PICTURE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+FIELDS = ["name", "grid", "solution", "time", "error"]
+
+
+def is_picture(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in PICTURE_EXTENSIONS
+
+
+def list_pictures(source: str) -> list:
+    """
+    List the puzzle pictures of a source.
+
+    Parameters
+    ----------
+    source : str
+        A directory, a glob pattern, a zip or tar archive of pictures, or a
+        picture.
+
+    Returns
+    -------
+    list of tuple or None
+        (name, kind, payload) items where kind is "path" (payload is a picture
+        path) or "archive" (payload is (archive path, member name)). None if
+        the source is a grid file. The members of a tar archive are listed in
+        their order in the archive, so that they are read in a single pass.
+    """
+    if os.path.isdir(source):
+        paths = sorted(
+            os.path.join(source, name)
+            for name in os.listdir(source)
+            if is_picture(name)
+        )
+        return [(path, "path", path) for path in paths]
+
+    if any(ch in source for ch in "*?["):
+        paths = sorted(path for path in glob.glob(source) if is_picture(path))
+        return [(path, "path", path) for path in paths]
+
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            names = sorted(name for name in archive.namelist() if is_picture(name))
+        return [(f"{source}:{name}", "archive", (source, name)) for name in names]
+
+    if tarfile.is_tarfile(source):
+        with tarfile.open(source) as archive:
+            names = [
+                member.name
+                for member in archive.getmembers()
+                if member.isfile() and is_picture(member.name)
+            ]
+        return [(f"{source}:{name}", "archive", (source, name)) for name in names]
+
+    if is_picture(source):
+        return [(source, "path", source)]
+
+    return None
+
+
+class ArchiveReader:
+    """
+    Read the members of a zip or tar archive through a single open handle.
+
+    A compressed tar archive can only be read forward, so its members must be
+    read in their order in the archive.
+    """
+
+    def __init__(self, archive_path: str):
+        if zipfile.is_zipfile(archive_path):
+            self.archive = zipfile.ZipFile(archive_path)
+            self.members = None
+        else:
+            self.archive = tarfile.open(archive_path)
+            self.members = iter(self.archive)
+
+    def read(self, name: str) -> bytes:
+        if self.members is None:
+            return self.archive.read(name)
+        for member in self.members:
+            if member.name == name:
+                return self.archive.extractfile(member).read()
+        raise KeyError(f"{name} isn't in the rest of the archive.")
+
+    def close(self):
+        self.archive.close()
+
+
+def read_archive_members(items):
+    """
+    Read the archive members of picture items in this process.
+
+    Parameters
+    ----------
+    items : iterable
+        Items of `list_pictures`.
+
+    Returns
+    -------
+    Iterator of tuple
+        The items, archive members being replaced by ("data", content) items,
+        or ("error", exception) items if they can't be read.
+    """
+    readers = dict()
+    try:
+        for name, kind, payload in items:
+            if kind == "archive":
+                archive_path, member_name = payload
+                try:
+                    if archive_path not in readers:
+                        readers[archive_path] = ArchiveReader(archive_path)
+                    kind, payload = "data", readers[archive_path].read(member_name)
+                except Exception as e:
+                    # Reported as the failure of this picture by the worker.
+                    kind, payload = "error", e
+            yield name, kind, payload
+    finally:
+        for reader in readers.values():
+            reader.close()
+
+
+def solve_picture(data: bytes) -> tuple:
+    """
+    Read and solve the grid of an encoded picture.
+
+    Parameters
+    ----------
+    data : bytes
+
+    Returns
+    -------
+    tuple of (np.ndarray, np.ndarray)
+        The read grid and its solution (None if it has no solution).
+    """
+    # Imported here so that solving text grids doesn't load the classifier.
+    from sudoku_reader.digits import predict_digit_probabilities
+    from sudoku_reader.picture import (
+        decode_picture,
+        extract_digit_pictures,
+        filter_cells,
+    )
+
+    cells = filter_cells(extract_digit_pictures(decode_picture(data)))
+    return solve_most_probable_grid(predict_digit_probabilities(cells))
+
+
+def process_picture(item: tuple) -> dict:
+    """
+    Read and solve one puzzle picture. Executed in a worker process.
+
+    Parameters
+    ----------
+    item : tuple
+        An item of `read_archive_members`.
+
+    Returns
+    -------
+    dict
+    """
+    name, kind, payload = item
+    start = time.perf_counter()
+    result = {"name": name, "grid": "", "solution": "", "time": 0.0, "error": ""}
+    try:
+        if kind == "path":
+            with open(payload, "rb") as f:
+                data = f.read()
+        elif kind == "error":
+            raise payload
+        else:
+            data = payload
+        grid, solution = solve_picture(data)
+
+        result["grid"] = format_grid(grid)
+        if solution is not None:
+            result["solution"] = format_grid(solution)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["time"] = round(time.perf_counter() - start, 6)
+    return result
+
+
+def drop_partial_line(output: str):
+    """
+    Truncate an output file after its last complete line, dropping the line of
+    an interrupted write.
+
+    Parameters
+    ----------
+    output : str
+
+    Returns
+    -------
+    None
+    """
+    with open(output, "r+b") as f:
+        end = position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            start = max(0, position - 4096)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b"\n")
+            if newline >= 0:
+                position = start + newline + 1
+                break
+            position = start
+        if position < end:
+            f.truncate(position)
+
+
+def read_done_names(output: str) -> set:
+    """
+    Get the names of the puzzles already written in an output file, after
+    dropping its incomplete last line if any.
+
+    Parameters
+    ----------
+    output : str
+
+    Returns
+    -------
+    set of str
+    """
+    if not os.path.exists(output):
+        return set()
+    drop_partial_line(output)
+    with open(output, newline="") as f:
+        if output.endswith(".csv"):
+            return {row["name"] for row in csv.DictReader(f)}
+        return {json.loads(line)["name"] for line in f if line.strip()}
+
+
+class ResultWriter:
+    """
+    Append results to a CSV or JSONL file, flushing after each result.
+    """
+
+    def __init__(self, output: str):
+        self.is_csv = output.endswith(".csv")
+        is_new = not os.path.exists(output) or os.path.getsize(output) == 0
+        self.file = open(output, "a", newline="")
+        if self.is_csv:
+            self.writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+            if is_new:
+                self.writer.writeheader()
+
+    def write(self, result: dict):
+        if self.is_csv:
+            self.writer.writerow(result)
+        else:
+            self.file.write(json.dumps(result) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def show_progress(done: int, total: int, failed: int, start: float):
+    elapsed = time.monotonic() - start
+    rate = done / elapsed if elapsed else 0.0
+    count = f"{done}/{total}" if total is not None else f"{done}"
+    sys.stderr.write(f"\r{count} puzzles, {failed} failed, {rate:.1f} puzzles/s")
+    sys.stderr.flush()
+
+
+def solve_pictures(items: list, jobs: int):
+    """
+    Read and solve puzzle pictures in worker processes.
+
+    Parameters
+    ----------
+    items : list
+        Items of `list_pictures`.
+    jobs : int
+        Number of worker processes.
+
+    Returns
+    -------
+    Iterator of dict
+        The results of `process_picture`, in their order of completion.
+    """
+    pending = set()
+    # The archives are read here, each one in a single pass.
+    remaining = read_archive_members(items)
+    with ProcessPoolExecutor(
+        max_workers=jobs, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        while True:
+            # Only a few items per worker are in flight at a time.
+            for item in remaining:
+                pending.add(executor.submit(process_picture, item))
+                if len(pending) >= 4 * jobs:
+                    break
+            if not pending:
+                break
+
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                yield future.result()
+
+
+def solve_grids(
+    source: str,
+    done_names: set,
+    jobs: int,
+    algorithm_type: AlgorithmType,
+    column: str = None,
+):
+    """
+    Solve the grids of a text, CSV or puzzle file.
+
+    Parameters
+    ----------
+    source : str
+        See `read_puzzles`.
+    done_names : set
+        Names of the puzzles to skip.
+    jobs : int
+        Number of worker processes.
+    algorithm_type : AlgorithmType
+    column : str, optional
+        The column of the grids in a CSV file.
+
+    Returns
+    -------
+    Iterator of dict
+        The results in the order of the file. Puzzles are named after their
+        position in the file.
+    """
+    names = deque()
+
+    def puzzles():
+        for number, puzzle in enumerate(read_puzzles(source, column), 1):
+            name = f"{source}:{number}"
+            if name not in done_names:
+                names.append(name)
+                yield puzzle
+
+    for result in solve_stream(puzzles(), algorithm_type, workers=jobs):
+        for key in ("grid", "solution"):
+            result[key] = format_grid(result[key]) if result[key] is not None else ""
+        result["time"] = round(result["time"], 6)
+        yield {"name": names.popleft(), **result}
+
+
+def run(
+    source: str,
+    output: str,
+    jobs: int = None,
+    algorithm_type: AlgorithmType = AlgorithmType.AC3,
+    column: str = None,
+    progress: bool = True,
+) -> int:
+    """
+    Process every puzzle of a source not already in the output file.
+
+    Parameters
+    ----------
+    source : str
+        See `list_pictures` and `read_puzzles`.
+    output : str
+        Path of a .csv or .jsonl file.
+    jobs : int, optional
+        Number of worker processes. Defaults to the number of CPUs. With the
+        portfolio, it is divided by the number of strategies.
+    algorithm_type : AlgorithmType, optional
+        Algorithm used to solve the grid files.
+    column : str, optional
+        The column of the grids in a CSV file.
+    progress : bool, optional
+        Display the progress on the standard error.
+
+    Returns
+    -------
+    int
+        The number of failed puzzles.
+    """
+    done_names = read_done_names(output)
+    jobs = jobs or os.cpu_count()
+
+    items = list_pictures(source)
+    if items is not None:
+        items = [item for item in items if item[0] not in done_names]
+        results, total = solve_pictures(items, jobs), len(items)
+    else:
+        if algorithm_type is AlgorithmType.PORTFOLIO:
+            # Each worker runs a process per strategy.
+            jobs = max(1, jobs // len(PORTFOLIO))
+        results = solve_grids(source, done_names, jobs, algorithm_type, column)
+        total = None
+
+    writer = ResultWriter(output)
+    done, failed, start = 0, 0, time.monotonic()
+    try:
+        for result in results:
+            writer.write(result)
+            done += 1
+            failed += bool(result["error"] or not result["solution"])
+            if progress:
+                show_progress(done, total, failed, start)
+    finally:
+        writer.close()
+        if progress:
+            sys.stderr.write("\n")
+    return failed
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m sudoku_reader.cli",
+        description="Read and solve sudoku puzzles in batch.",
+    )
+    parser.add_argument(
+        "source",
+        help="a directory, glob pattern or archive of pictures, "
+        "or a text, CSV or puzzle file of grids",
+    )
+    parser.add_argument("output", help="the .csv or .jsonl result file")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="number of worker processes"
+    )
+    parser.add_argument(
+        "-a",
+        "--algorithm",
+        default=AlgorithmType.AC3.name,
+        choices=[algorithm_type.name for algorithm_type in AlgorithmType],
+        help="algorithm used to solve the grid files",
+    )
+    parser.add_argument("--column", help="the column of the grids in a CSV file")
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", help="don't display the progress"
+    )
+    args = parser.parse_args(argv)
+
+    if not args.output.endswith((".csv", ".jsonl")):
+        parser.error("the output file must be a .csv or a .jsonl file")
+
+    failed = run(
+        args.source,
+        args.output,
+        jobs=args.jobs,
+        algorithm_type=AlgorithmType[args.algorithm],
+        column=args.column,
+        progress=not args.quiet,
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
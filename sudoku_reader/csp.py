@@ -96,6 +96,60 @@ class CSP:
     def consistent_with(self, assignment: dict, new_assignment: dict) -> bool:
         return self.consistent(assignment | new_assignment)
 
+    def conflicts(self, assignment: dict, var: any, value: any) -> set:
+        """
+        Get the assigned variables conflicting with a new assignment.
+
+        Parameters
+        ----------
+        assignment : dict
+            A consistent assignment.
+        var : any
+            An unassigned variable.
+        value : any
+            The value assigned to the variable.
+
+        Returns
+        -------
+        set
+            The other variables of the constraints violated by the new
+            assignment.
+
+        """
+        new_assignment = assignment | {var: value}
+        conflicting = set()
+        for constraint in self.var_to_const[var]:
+            if all(v in new_assignment for v in constraint.scope):
+                if not constraint.satisfied(new_assignment):
+                    conflicting |= constraint.scope - {var}
+        return conflicting
+
+
+def is_consistent_map(sudoku_map: np.ndarray) -> bool:
+    """
+    Check that no digit is repeated in a row, a column or a box of a sudoku map.
+
+    Parameters
+    ----------
+    sudoku_map : np.ndarray
+        A N x N array (empty => 0).
+
+    Returns
+    -------
+    bool
+    """
+    length = len(sudoku_map)
+    size = round(math.sqrt(length))
+    boxes = (
+        sudoku_map.reshape(size, size, size, size).swapaxes(1, 2).reshape(length, -1)
+    )
+    for units in (sudoku_map, sudoku_map.T, boxes):
+        for values in units:
+            values = values[values != 0]
+            if len(values) != len(np.unique(values)):
+                return False
+    return True
+
 
 class SudokuCSP(CSP):
     def __init__(self, sudoku_map: np.ndarray):
@@ -107,6 +161,9 @@ class SudokuCSP(CSP):
         variables = list()
         domains = dict()
         constraints = list()
+        # Constraints already added, as the list is too slow to search for
+        # large grids.
+        added = set()
 
         size = round(math.sqrt(len(sudoku_map)))
 
@@ -124,14 +181,16 @@ class SudokuCSP(CSP):
                     constraint = Constraint(
                         frozenset({f"{x}, {y}", f"{x_row}, {y}"}), constraint_evalution
                     )
-                    if x_row != x and constraint not in constraints:
+                    if x_row != x and constraint not in added:
+                        added.add(constraint)
                         constraints.append(constraint)
 
                 for y_col in range(len(sudoku_map)):
                     constraint = Constraint(
                         frozenset({f"{x}, {y}", f"{x}, {y_col}"}), constraint_evalution
                     )
-                    if y_col != y and constraint not in constraints:
+                    if y_col != y and constraint not in added:
+                        added.add(constraint)
                         constraints.append(constraint)
 
                 for i in range(size):
@@ -150,7 +209,8 @@ class SudokuCSP(CSP):
                             constraint_evalution,
                         )
 
-                        if x_box != x and y_box != y and constraint not in constraints:
+                        if x_box != x and y_box != y and constraint not in added:
+                            added.add(constraint)
                             constraints.append(constraint)
 
         super().__init__(variables, domains, constraints)
@@ -173,3 +233,22 @@ class SudokuCSP(CSP):
             for y in range(0, len(self.sudoku_map)):
                 result[x, y] = assignment[f"{x}, {y}"]
         return result
+
+    def get_partial_map(self, assignment: dict) -> np.ndarray:
+        """
+        Get the map of a partial assignment, unassigned cells being empty.
+
+        Parameters
+        ----------
+        assignment : dict
+
+        Returns
+        -------
+        np.ndarray
+
+        """
+        result = np.zeros_like(self.sudoku_map)
+        for x in range(0, len(self.sudoku_map)):
+            for y in range(0, len(self.sudoku_map)):
+                result[x, y] = assignment.get(f"{x}, {y}", 0)
+        return result
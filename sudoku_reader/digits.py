@@ -3,10 +3,13 @@ Digits treatment module.
 """
 import pathlib
 import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 
 import numpy as np
-from scipy import ndimage
-import skimage.transform
 import keras
 
 
@@ -15,60 +18,261 @@ MODEL = keras.models.load_model(
 )
 
 
-def filter_cells(digits: list):
+class DigitCache:
     """
-    Filter each given cell to isolate and center the digit in 28x28 binary array.
+    A bounded LRU cache of predicted digit probabilities keyed by a perceptual
+    hash of the normalized 28x28 cell pictures.
+    """
+
+    def __init__(self, max_size: int = 4096):
+        """
+        Create a DigitCache instance.
+
+        Parameters
+        ----------
+        max_size : int, optional
+            Maximum number of cached cells.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(cell: np.ndarray) -> bytes:
+        """
+        Hash a 28x28 cell picture so that near-identical cells share a key.
+
+        Each 2x2 block is reduced to one bit set if at least half of its pixels
+        are set.
+
+        Parameters
+        ----------
+        cell : np.ndarray
+
+        Returns
+        -------
+        bytes
+        """
+        cell = np.asarray(cell).reshape(28, 28) > 0
+        blocks = cell.reshape(14, 2, 14, 2).sum(axis=(1, 3))
+        return np.packbits(blocks >= 2).tobytes()
+
+    def get(self, key: bytes):
+        """
+        Get the cached probabilities of a key.
+
+        Parameters
+        ----------
+        key : bytes
+
+        Returns
+        -------
+        np.ndarray or None
+        """
+        with self._lock:
+            probabilities = self._entries.get(key)
+            if probabilities is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return probabilities
+
+    def put(self, key: bytes, probabilities: np.ndarray):
+        """
+        Store the probabilities of a key, evicting the least recently used
+        entry when the cache is full.
+
+        Parameters
+        ----------
+        key : bytes
+        probabilities : np.ndarray
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._entries[key] = probabilities
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+DIGIT_CACHE = DigitCache()
+
+
+def predict_digit_probabilities(cells: list, cache: DigitCache = DIGIT_CACHE):
+    """
+    Predict the probability of each digit from picture using CNN.
+
+    The cells missing from the cache are classified in a single batch.
 
     Parameters
     ----------
-    digits : array of ((x, y), binary_image)
+    cells : array of ((x, y), 28x28 binary image)
+    cache : DigitCache, optional
+        Cache of the already predicted cells. None disables it.
 
     Returns
     -------
-    An array of the same shape than the given array.
+    array of ((x, y), vector of the 10 digit probabilities)
+    """
+    keys = [cache.key(cell) if cache is not None else None for _, cell in cells]
+    predicted_probabilities = [
+        cache.get(key) if cache is not None else None for key in keys
+    ]
+
+    missing = [i for i, probs in enumerate(predicted_probabilities) if probs is None]
+    if missing:
+        batch = np.stack([np.reshape(cells[i][1], (28, 28)) for i in missing])
+        for i, probabilities in zip(missing, MODEL.predict(batch)):
+            predicted_probabilities[i] = probabilities
+            if cache is not None:
+                cache.put(keys[i], probabilities)
+
+    return [[cells[i][0], predicted_probabilities[i]] for i in range(len(cells))]
+
+
+class DigitBatcher:
     """
-    filtered_digits = digits.copy()
+    Coalesce the cells of concurrent callers into single classifier calls.
 
-    for i in range(len(digits)):
-        img = np.where(filtered_digits[i][1] == 0.0, filtered_digits[i][1], 1.0)
+    A background thread waits up to `max_delay` seconds after the first
+    request, or until `max_batch` cells are gathered, then classifies all the
+    gathered cells at once and gives each caller its own results.
+    """
+
+    def __init__(
+        self,
+        max_batch: int = 256,
+        max_delay: float = 0.005,
+        cache: DigitCache = DIGIT_CACHE,
+    ):
+        """
+        Create a DigitBatcher instance.
+
+        Parameters
+        ----------
+        max_batch : int, optional
+            Number of cells above which a batch is classified without waiting.
+        max_delay : float, optional
+            Maximum time in seconds a request waits for other requests.
+        cache : DigitCache, optional
+            Cache of the already predicted cells. None disables it.
+        """
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.cache = cache
+        self.batches = 0
+        self.batched_requests = 0
+        self._requests = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def predict(self, cells: list) -> list:
+        """
+        Predict the probability of each digit, batched with concurrent calls.
+
+        Parameters
+        ----------
+        cells : array of ((x, y), 28x28 binary image)
 
-        labeled_img, nb_labels = ndimage.label(img)
-        sizes = ndimage.sum_labels(img, labeled_img, range(nb_labels + 1))
+        Returns
+        -------
+        array of ((x, y), vector of the 10 digit probabilities)
+        """
+        if not cells:
+            return list()
 
-        digit_label = np.argmax(sizes)
-        digit_slice = ndimage.find_objects(labeled_img == digit_label)[0]
-        img = skimage.transform.resize(img[digit_slice], (18, 18), anti_aliasing=False)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
 
-        template = np.zeros((28, 28))
-        width, height = img.shape
-        padding_x = int((28 - width) / 2)
-        padding_y = int((28 - height) / 2)
+        future = Future()
+        self._requests.put((cells, future))
+        return future.result()
 
-        template[padding_x : padding_x + width, padding_y : padding_y + height] = img
+    def _run(self):
+        while True:
+            requests = [self._requests.get()]
+            count = len(requests[0][0])
+            deadline = time.monotonic() + self.max_delay
 
-        filtered_digits[i][1] = template.astype('uint8')
+            while count < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                requests.append(request)
+                count += len(request[0])
 
-    return filtered_digits
+            try:
+                probabilities = predict_digit_probabilities(
+                    [cell for cells, _ in requests for cell in cells], self.cache
+                )
+            except Exception:
+                # Some request has bad cells: classify the requests one by
+                # one so that only the faulty ones fail.
+                self._run_separately(requests)
+                continue
 
+            self.batches += 1
+            self.batched_requests += len(requests)
 
-def predict_digit_from_picture(cells: list):
+            start = 0
+            for cells, future in requests:
+                future.set_result(probabilities[start : start + len(cells)])
+                start += len(cells)
+
+    def _run_separately(self, requests: list):
+        for cells, future in requests:
+            try:
+                probabilities = predict_digit_probabilities(cells, self.cache)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            self.batches += 1
+            self.batched_requests += 1
+            future.set_result(probabilities)
+
+
+def predict_digit_from_picture(cells: list, cache: DigitCache = DIGIT_CACHE):
     """
     Predict digits from picture using CNN.
 
     Parameters
     ----------
-    cells
+    cells : array of ((x, y), 28x28 binary image)
+    cache : DigitCache, optional
+        Cache of the already predicted cells. None disables it.
 
     Returns
     -------
-
+    array of ((x, y), digit)
     """
-    predicted_digits = list()
-    for i in range(len(cells)):
-        if len(cells[i][1].shape) < 3:
-            cell = np.expand_dims(cells[i][1], 0)
-        else:
-            cell = cells[i][1]
-        prediction = np.argmax(MODEL.predict(cell))
-        predicted_digits.append([cells[i][0], prediction])
-    return predicted_digits
+    return [
+        [position, np.argmax(probabilities)]
+        for position, probabilities in predict_digit_probabilities(cells, cache)
+    ]
@@ -2,6 +2,7 @@
 """Generate sudoku puzzles.
 
 """
+import math
 import random
 from enum import Enum
 
@@ -10,6 +11,7 @@ import requests
 
 from sudoku_reader.csp import SudokuCSP
 from sudoku_reader.algorithms import backtracking_search, random_domain_values
+from sudoku_reader.puzzles import PuzzleWriter
 
 
 class SudokuDifficulty(Enum):
@@ -39,12 +41,25 @@ class Generator:
     def generate_backtracking(
         cls, size: int = 3, difficulty: SudokuDifficulty = SudokuDifficulty.MEDIUM
     ):
+        return cls.remove_digits(cls.generate_solved(size), difficulty)
+
+    @classmethod
+    def generate_solved(cls, size: int = 3):
         sudoku_map = np.zeros((size ** 2, size ** 2), dtype=int)
 
         csp = SudokuCSP(sudoku_map)
 
         assignment = backtracking_search(csp, order_domain_values=random_domain_values)
-        sudoku_map = csp.get_resulted_map(assignment)
+        return csp.get_resulted_map(assignment)
+
+    @classmethod
+    def remove_digits(
+        cls,
+        sudoku_map: np.ndarray,
+        difficulty: SudokuDifficulty = SudokuDifficulty.MEDIUM,
+    ):
+        sudoku_map = sudoku_map.copy()
+        size = math.isqrt(len(sudoku_map))
 
         if difficulty == SudokuDifficulty.EASY:
             i = int(0.5 * (size ** 4))
@@ -62,3 +77,43 @@ class Generator:
                 i -= 1
 
         return sudoku_map
+
+    @classmethod
+    def generate_file(
+        cls,
+        file_path: str,
+        count: int,
+        size: int = 3,
+        difficulty: SudokuDifficulty = SudokuDifficulty.MEDIUM,
+        batch_size: int = 256,
+    ):
+        """
+        Append generated puzzles and their solutions to a puzzle file.
+
+        Parameters
+        ----------
+        file_path : str
+        count : int
+            Number of puzzles to generate.
+        size : int, optional
+        difficulty : SudokuDifficulty, optional
+        batch_size : int, optional
+            Number of puzzles written at once.
+
+        Returns
+        -------
+        None
+        """
+        levels = list(SudokuDifficulty)
+        with PuzzleWriter(
+            file_path, size ** 2, solution=True, metadata={"difficulty": "u1"}
+        ) as writer:
+            for start in range(0, count, batch_size):
+                solutions = [
+                    cls.generate_solved(size)
+                    for _ in range(min(batch_size, count - start))
+                ]
+                grids = [
+                    cls.remove_digits(solution, difficulty) for solution in solutions
+                ]
+                writer.write(grids, solutions, difficulty=levels.index(difficulty))
@@ -36,7 +36,7 @@ from PySide6.QtWidgets import (
 import skimage.io
 import numpy as np
 
-from generator import Generator, SudokuDifficulty
+from generator import SudokuDifficulty
 from interfaces import AlgorithmType, Resolver
 
 
@@ -64,8 +64,10 @@ class MainWindow(QMainWindow):
 
     resolve = Signal((AlgorithmType, np.ndarray))
     analyse_picture = Signal(np.ndarray)
+    generate = Signal(bool, int, object)
+    prefetch = Signal(bool, int, object)
 
-    def __init__(self, title: str, resolver: Resolver, importer):
+    def __init__(self, title: str, resolver: Resolver, importer, generator):
         """
         Constructs all the necessary attributes for the main window object.
         """
@@ -100,6 +102,7 @@ class MainWindow(QMainWindow):
         self.resolver_thread = QThread()
         self.resolve.connect(resolver.do_work)
         resolver.result_ready.connect(self.handle_result)
+        resolver.progress.connect(self.handle_progress)
         resolver.error.connect(
             lambda x: self.handle_error("An error as occured while solving the puzzle.")
         )
@@ -115,6 +118,18 @@ class MainWindow(QMainWindow):
         )
         importer.moveToThread(self.importer_thread)
 
+        self.generator_thread = QThread()
+        self.generate.connect(generator.do_work)
+        self.prefetch.connect(generator.prefetch)
+        generator.result_ready.connect(self.handle_generated)
+        generator.error.connect(
+            lambda x: self.handle_error(
+                "An error as occured while generating the puzzle."
+            )
+        )
+        generator.moveToThread(self.generator_thread)
+        self.difficulty = SudokuDifficulty.MEDIUM
+
         self.setCentralWidget(QtWidgets.QWidget())
         self.centralWidget().setLayout(self.layout)
 
@@ -123,8 +138,12 @@ class MainWindow(QMainWindow):
 
         self.resolver_thread.start()
         self.importer_thread.start()
+        self.generator_thread.start()
+        self.prefetch.emit(False, self.size, self.difficulty)
 
     def create_sudoku_view(self, n: int = 3):
+        # Digits shown by the editors, -1 for a cell edited by the user.
+        self.displayed_map = np.zeros((n ** 2, n ** 2), dtype=int)
 
         for y in range(0, n ** 2):
             for x in range(0, n ** 2):
@@ -139,6 +158,9 @@ class MainWindow(QMainWindow):
 
                 editor = QLineEdit()
                 editor.setAlignment(Qt.AlignCenter)
+                editor.textEdited.connect(
+                    lambda text, x=x, y=y: self.handle_cell_edit([x, y])
+                )
                 proxy = self.sudoku_scene.addWidget(editor)
                 proxy.setPos(QPointF(self.cell_width * x + 1, self.cell_width * y + 1))
                 proxy.setFont(QFont("Arial", self.cell_width / 2, QFont.Bold))
@@ -238,6 +260,16 @@ class MainWindow(QMainWindow):
             lambda x: self.handle_resolve(AlgorithmType.MRV)
         )
 
+        solve_mrv_degree_action = QAction("MRV with degree tie-breaking", self)
+        solve_mrv_degree_action.triggered.connect(
+            lambda x: self.handle_resolve(AlgorithmType.MRV_DEGREE)
+        )
+
+        solve_mrv_restarts_action = QAction("MRV with restarts", self)
+        solve_mrv_restarts_action.triggered.connect(
+            lambda x: self.handle_resolve(AlgorithmType.MRV_RESTARTS)
+        )
+
         solve_ac3_action = QAction("AC-3", self)
         solve_ac3_action.triggered.connect(
             lambda x: self.handle_resolve(AlgorithmType.AC3)
@@ -253,13 +285,33 @@ class MainWindow(QMainWindow):
             lambda x: self.handle_resolve(AlgorithmType.LEAST_CONSTRAINING_H)
         )
 
+        solve_sat_action = QAction("SAT (clause learning)", self)
+        solve_sat_action.triggered.connect(
+            lambda x: self.handle_resolve(AlgorithmType.SAT)
+        )
+
+        solve_propagation_action = QAction("Singles propagation", self)
+        solve_propagation_action.triggered.connect(
+            lambda x: self.handle_resolve(AlgorithmType.PROPAGATION)
+        )
+
+        solve_portfolio_action = QAction("Portfolio (first of all)", self)
+        solve_portfolio_action.triggered.connect(
+            lambda x: self.handle_resolve(AlgorithmType.PORTFOLIO)
+        )
+
         self.solve_menu.addActions(
             [
                 solve_backtracking_action,
                 solve_mrv_action,
+                solve_mrv_degree_action,
+                solve_mrv_restarts_action,
                 solve_ac3_action,
                 solve_degree_h_action,
                 solve_least_constraining_h_action,
+                solve_sat_action,
+                solve_propagation_action,
+                solve_portfolio_action,
             ]
         )
         self.menuBar().addMenu(self.solve_menu)
@@ -272,18 +324,18 @@ class MainWindow(QMainWindow):
     def clear_cell(self, pos: np.array):
         self.box_map[pos[0]][pos[1]].widget().clear()
 
-    def update_sudoku_view(self):
-        self.sudoku_scene.clear()
-
-        self.create_sudoku_view(self.size)
-
-        for y in range(self.length):
-            for x in range(self.length):
+    def handle_cell_edit(self, pos: list):
+        self.displayed_map[pos[0], pos[1]] = -1
 
+    def update_sudoku_view(self):
+        # Only the cells whose digit changed are updated.
+        for x, y in np.argwhere(self.digits_map != self.displayed_map):
+            if self.digits_map[x, y] != 0:
+                self.draw_number(self.digits_map[x, y], np.array([x, y]))
+            else:
                 self.clear_cell([x, y])
 
-                if self.digits_map[x, y] != 0:
-                    self.draw_number(self.digits_map[x, y], np.array([x, y]))
+        self.displayed_map = np.array(self.digits_map, dtype=int)
 
     def handle_error(self, error_message: str):
         QMessageBox.critical(self, "Error", error_message)
@@ -312,17 +364,19 @@ class MainWindow(QMainWindow):
                 )
                 return
             self.info_message.clear()
-            self.digits_map = Generator.generate_online(
-                self.size, action.data()["difficulty"]
-            )
         else:
             self.info_message.setText(
                 "The uniqueness of this homemade generated puzzle isn't guaranteed."
             )
-            self.digits_map = Generator.generate_backtracking(
-                self.size, action.data()["difficulty"]
-            )
 
+        self.difficulty = action.data()["difficulty"]
+        self.generate.emit(action.data()["is_online"], self.size, self.difficulty)
+
+    def handle_generated(self, sudoku_map: np.ndarray):
+        # Ignore a puzzle generated before a size change.
+        if len(sudoku_map) != self.length:
+            return
+        self.digits_map = np.array(sudoku_map)
         self.update_sudoku_view()
 
     def handle_resolve(self, algorithm_type: AlgorithmType):
@@ -344,9 +398,20 @@ class MainWindow(QMainWindow):
 
     def handle_result(self, algorithm_type: AlgorithmType, sudoku_map: np.array):
         print(f"Sudoku resolved using {algorithm_type.value} algorithm!")
+        self.statusBar().clearMessage()
         self.digits_map = sudoku_map
         self.update_sudoku_view()
 
+    def handle_progress(self, snapshot: dict):
+        sudoku_map = snapshot["sudoku_map"]
+        if sudoku_map is not None and len(sudoku_map) == self.length:
+            self.digits_map = sudoku_map
+            self.update_sudoku_view()
+        self.statusBar().showMessage(
+            f"{snapshot['nodes']} nodes ({snapshot['nodes_per_second']:.0f}/s), "
+            f"depth {snapshot['depth']}"
+        )
+
     def handle_size_edit(self):
         if isinstance(self.sender(), QAction):
             for action in self.size_actions:
@@ -369,4 +434,5 @@ class MainWindow(QMainWindow):
             ]
             self.digits_map = np.zeros((self.length, self.length), dtype=int)
 
-            self.update_sudoku_view()
+            self.create_sudoku_view(self.size)
+            self.prefetch.emit(False, self.size, self.difficulty)
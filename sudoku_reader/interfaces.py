@@ -14,9 +14,14 @@ from PySide6.QtCore import Signal, QObject
 class AlgorithmType(Enum):
     BACKTRACKING = "Backtracking"
     MRV = "MRV"
+    MRV_DEGREE = "MRV with degree tie-breaking"
+    MRV_RESTARTS = "MRV with restarts"
     AC3 = "AC-3"
     DEGREE_H = "Degree heuristic"
     LEAST_CONSTRAINING_H = "Least constraining value"
+    SAT = "SAT (clause learning)"
+    PROPAGATION = "Singles propagation"
+    PORTFOLIO = "Portfolio"
 
 
 class Cell:
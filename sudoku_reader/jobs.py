@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""Asynchronous jobs.
+
+This module runs jobs with a bounded number of pending jobs and a timeout per
+job. The CPU-bound stages of the jobs are executed in a pool of worker
+processes.
+
+"""
+import multiprocessing
+import threading
+import time
+import uuid
+from concurrent.futures import (
+    CancelledError,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from enum import Enum
+
+
+class JobStatus(Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    TIMEOUT = "timeout"
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class Job:
+    """
+    A job submitted to a JobQueue.
+    """
+
+    def __init__(self, future, timeout: float, submitted_at: float = None):
+        """
+        Create a Job instance.
+
+        Parameters
+        ----------
+        future : concurrent.futures.Future
+            The future of the job.
+        timeout : float
+            Time in seconds allowed to the job from its submission.
+        submitted_at : float, optional
+            Submission time, from `time.monotonic`. Defaults to now.
+        """
+        self.id = uuid.uuid4().hex
+        self.future = future
+        self.submitted_at = submitted_at or time.monotonic()
+        self.deadline = self.submitted_at + timeout
+        self.finished_at = None
+        future.add_done_callback(self._finished)
+
+    def _finished(self, future):
+        self.finished_at = time.monotonic()
+
+    @property
+    def status(self) -> JobStatus:
+        if self.future.done() and not self.future.cancelled():
+            if self.finished_at is not None and self.finished_at > self.deadline:
+                return JobStatus.TIMEOUT
+            if self.future.exception() is not None:
+                return JobStatus.FAILED
+            return JobStatus.DONE
+        if time.monotonic() > self.deadline or self.future.cancelled():
+            # A running job can't be interrupted, but its result is discarded.
+            self.future.cancel()
+            return JobStatus.TIMEOUT
+        if self.future.running():
+            return JobStatus.RUNNING
+        return JobStatus.PENDING
+
+    def result(self, timeout: float = None):
+        """
+        Wait for the result of the job.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum time to wait in seconds. The wait never goes past the
+            deadline of the job.
+
+        Returns
+        -------
+        The result of the job.
+
+        Raises
+        ------
+        TimeoutError
+            If the job isn't finished in time.
+        """
+        remaining = max(0.0, self.deadline - time.monotonic())
+        if timeout is not None:
+            remaining = min(remaining, timeout)
+        try:
+            result = self.future.result(timeout=remaining)
+        except (FutureTimeoutError, CancelledError):
+            if self.status is JobStatus.TIMEOUT:
+                raise TimeoutError(f"The job {self.id} timed out.")
+            raise TimeoutError(f"The job {self.id} isn't finished yet.")
+        if self.status is JobStatus.TIMEOUT:
+            raise TimeoutError(f"The job {self.id} timed out.")
+        return result
+
+    def as_dict(self) -> dict:
+        status = self.status
+        job = {"id": self.id, "status": status.value}
+        if status is JobStatus.FAILED:
+            job["error"] = str(self.future.exception())
+        return job
+
+
+class JobQueue:
+    """
+    A queue of jobs.
+
+    Each job runs in its own thread of the process owning the queue, so that
+    it can share in-process resources such as a DigitBatcher, and runs its
+    CPU-bound stages in the worker processes through `run_in_worker`. The
+    workers are started with the "spawn" method so that each of them imports
+    the application modules once.
+    """
+
+    def __init__(
+        self,
+        workers: int = None,
+        max_pending: int = 32,
+        timeout: float = 30.0,
+        retention: float = 300.0,
+    ):
+        """
+        Create a JobQueue instance.
+
+        Parameters
+        ----------
+        workers : int, optional
+            Number of worker processes. Defaults to the number of CPUs.
+        max_pending : int, optional
+            Maximum number of unfinished jobs. Further submissions are refused.
+        timeout : float, optional
+            Time in seconds allowed to each job.
+        retention : float, optional
+            Time in seconds during which a finished job can be polled.
+        """
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.retention = retention
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self.threads = ThreadPoolExecutor(
+            max_workers=max_pending, thread_name_prefix="job"
+        )
+        self.jobs = dict()
+        self._lock = threading.Lock()
+        # The deadline of the job run by the current job thread.
+        self._local = threading.local()
+        # The futures of the stages submitted to the workers.
+        self._stages = set()
+
+    def pending_count(self) -> int:
+        return sum(1 for job in self.jobs.values() if not job.future.done())
+
+    def submit(self, function: callable, *args) -> Job:
+        """
+        Submit a job.
+
+        Parameters
+        ----------
+        function : callable
+            A function executed in a job thread.
+        args
+            Its arguments.
+
+        Returns
+        -------
+        Job
+
+        Raises
+        ------
+        QueueFullError
+            If too many jobs are unfinished.
+        """
+        with self._lock:
+            self.prune()
+            if self.pending_count() >= self.max_pending:
+                raise QueueFullError("Too many pending jobs.")
+            submitted_at = time.monotonic()
+            future = self.threads.submit(
+                self._run_job, submitted_at + self.timeout, function, *args
+            )
+            job = Job(future, self.timeout, submitted_at)
+            self.jobs[job.id] = job
+            return job
+
+    def _run_job(self, deadline: float, function: callable, *args):
+        self._local.deadline = deadline
+        try:
+            return function(*args)
+        finally:
+            self._local.deadline = None
+
+    def run_in_worker(self, function: callable, *args):
+        """
+        Run a CPU-bound stage of a job in a worker process and wait for it.
+
+        Parameters
+        ----------
+        function : callable
+            A picklable function executed in a worker process.
+        args
+            Its picklable arguments.
+
+        Returns
+        -------
+        The result of the function.
+
+        Raises
+        ------
+        TimeoutError
+            If the stage isn't finished before the deadline of the job. A
+            stage already running goes on in its worker, but the job thread is
+            released.
+        """
+        deadline = getattr(self._local, "deadline", None)
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                raise TimeoutError("The job timed out.")
+
+        future = self.executor.submit(function, *args)
+        with self._lock:
+            self._stages.add(future)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError("The job timed out.")
+        finally:
+            with self._lock:
+                self._stages.discard(future)
+
+    def get(self, job_id: str) -> Job:
+        """
+        Get a job from its id.
+
+        Parameters
+        ----------
+        job_id : str
+
+        Returns
+        -------
+        Job or None if the job doesn't exist or has expired.
+        """
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def prune(self):
+        now = time.monotonic()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished_at is not None and now - job.finished_at > self.retention:
+                self.jobs.pop(job_id)
+
+    def shutdown(self):
+        with self._lock:
+            futures = [job.future for job in self.jobs.values()]
+            futures += self._stages
+        for future in futures:
+            future.cancel()
+        self.threads.shutdown(wait=False)
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""Propagation kernels.
+
+The kernels work on sudoku maps (N x N int64 arrays, empty => 0) and on
+candidate masks, the bit v of the mask of an empty cell being set when v is a
+candidate of the cell. They are compiled with Numba when it is installed, and
+replaced otherwise by NumPy implementations giving the same results. The
+backend is chosen at import and reported by `BACKEND`; setting the
+SUDOKU_KERNELS environment variable to "numpy" forces the NumPy one.
+
+"""
+import os
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+if numba is not None and os.environ.get("SUDOKU_KERNELS", "numba") != "numpy":
+    BACKEND = "numba"
+else:
+    BACKEND = "numpy"
+
+
+def unit_cell(unit: int, u: int, i: int, size: int) -> tuple:
+    """
+    Get the i-th cell of the u-th row (unit 0), column (unit 1) or box
+    (unit 2).
+    """
+    if unit == 0:
+        return u, i
+    if unit == 1:
+        return i, u
+    return size * (u // size) + i // size, size * (u % size) + i % size
+
+
+def candidate_masks_loops(sudoku_map: np.ndarray, size: int) -> np.ndarray:
+    length = size * size
+    full = (1 << (length + 1)) - 2
+    rows = np.zeros(length, np.int64)
+    columns = np.zeros(length, np.int64)
+    boxes = np.zeros(length, np.int64)
+    for x in range(length):
+        for y in range(length):
+            if sudoku_map[x, y]:
+                bit = 1 << sudoku_map[x, y]
+                rows[x] |= bit
+                columns[y] |= bit
+                boxes[size * (x // size) + y // size] |= bit
+
+    masks = np.zeros((length, length), np.int64)
+    for x in range(length):
+        for y in range(length):
+            if not sudoku_map[x, y]:
+                used = rows[x] | columns[y] | boxes[size * (x // size) + y // size]
+                masks[x, y] = full & ~used
+    return masks
+
+
+def eliminate_loops(masks: np.ndarray, x: int, y: int, value: int, size: int):
+    length = size * size
+    keep = ~(1 << value)
+    for i in range(length):
+        masks[x, i] &= keep
+        masks[i, y] &= keep
+    x_box, y_box = size * (x // size), size * (y // size)
+    for i in range(size):
+        for j in range(size):
+            masks[x_box + i, y_box + j] &= keep
+    masks[x, y] = 0
+
+
+def unit_digit_counts_loops(masks: np.ndarray, size: int) -> np.ndarray:
+    length = size * size
+    counts = np.zeros((3, length, length + 1), np.int64)
+    for x in range(length):
+        for y in range(length):
+            mask = masks[x, y]
+            for value in range(1, length + 1):
+                if (mask >> value) & 1:
+                    counts[0, x, value] += 1
+                    counts[1, y, value] += 1
+                    counts[2, size * (x // size) + y // size, value] += 1
+    return counts
+
+
+def candidate_counts_loops(masks: np.ndarray, size: int) -> np.ndarray:
+    length = size * size
+    counts = np.zeros((length, length), np.int64)
+    for x in range(length):
+        for y in range(length):
+            mask = masks[x, y]
+            while mask:
+                mask &= mask - 1
+                counts[x, y] += 1
+    return counts
+
+
+def find_singles_loops(masks: np.ndarray, size: int) -> np.ndarray:
+    length = size * size
+    singles = np.zeros((4 * length * length, 3), np.int64)
+    count = 0
+    for x in range(length):
+        for y in range(length):
+            mask = masks[x, y]
+            if mask and not mask & (mask - 1):
+                value = 0
+                while mask > 1:
+                    mask >>= 1
+                    value += 1
+                singles[count, 0], singles[count, 1] = x, y
+                singles[count, 2] = value
+                count += 1
+
+    counts = unit_digit_counts(masks, size)
+    for unit in range(3):
+        for u in range(length):
+            for value in range(1, length + 1):
+                if counts[unit, u, value] == 1:
+                    for i in range(length):
+                        x, y = unit_cell(unit, u, i, size)
+                        if (masks[x, y] >> value) & 1:
+                            singles[count, 0], singles[count, 1] = x, y
+                            singles[count, 2] = value
+                            count += 1
+                            break
+    return singles[:count]
+
+
+def propagate_loops(sudoku_map: np.ndarray, size: int) -> tuple:
+    length = size * size
+    current = sudoku_map.copy()
+    masks = candidate_masks(current, size)
+    while True:
+        for x in range(length):
+            for y in range(length):
+                if not current[x, y] and not masks[x, y]:
+                    return current, masks, False
+
+        singles = find_singles(masks, size)
+        if not len(singles):
+            return current, masks, True
+        for k in range(len(singles)):
+            x, y, value = singles[k, 0], singles[k, 1], singles[k, 2]
+            if current[x, y] == value:
+                continue
+            if current[x, y] or not (masks[x, y] >> value) & 1:
+                return current, masks, False
+            current[x, y] = value
+            eliminate(masks, x, y, value, size)
+
+
+def box_cells(size: int) -> tuple:
+    # Coordinates of the i-th cell of the u-th box, as two (N, N) arrays.
+    length = size * size
+    u, i = np.divmod(np.arange(length * length), length)
+    x = size * (u // size) + i // size
+    y = size * (u % size) + i % size
+    return x.reshape(length, length), y.reshape(length, length)
+
+
+def candidate_masks_numpy(sudoku_map: np.ndarray, size: int) -> np.ndarray:
+    length = size * size
+    full = (1 << (length + 1)) - 2
+    bits = np.where(sudoku_map > 0, np.left_shift(1, sudoku_map), 0).astype(np.int64)
+    rows = np.bitwise_or.reduce(bits, axis=1)
+    columns = np.bitwise_or.reduce(bits, axis=0)
+    boxes = np.bitwise_or.reduce(
+        bits.reshape(size, size, size, size).swapaxes(1, 2).reshape(size, size, -1),
+        axis=2,
+    )
+    used = (
+        rows[:, None]
+        | columns[None, :]
+        | np.repeat(np.repeat(boxes, size, axis=0), size, axis=1)
+    )
+    return np.where(sudoku_map == 0, full & ~used, 0).astype(np.int64)
+
+
+def eliminate_numpy(masks: np.ndarray, x: int, y: int, value: int, size: int):
+    keep = ~(1 << int(value))
+    masks[x, :] &= keep
+    masks[:, y] &= keep
+    x_box, y_box = size * (x // size), size * (y // size)
+    masks[x_box : x_box + size, y_box : y_box + size] &= keep
+    masks[x, y] = 0
+
+
+def unit_digit_counts_numpy(masks: np.ndarray, size: int) -> np.ndarray:
+    length = size * size
+    bits = (masks[:, :, None] >> np.arange(length + 1)) & 1
+    boxes = (
+        bits.reshape(size, size, size, size, -1)
+        .swapaxes(1, 2)
+        .reshape(length, length, -1)
+    )
+    return np.stack((bits.sum(axis=1), bits.sum(axis=0), boxes.sum(axis=1))).astype(
+        np.int64
+    )
+
+
+def candidate_counts_numpy(masks: np.ndarray, size: int) -> np.ndarray:
+    length = size * size
+    bits = (masks[:, :, None] >> np.arange(length + 1)) & 1
+    return bits.sum(axis=2).astype(np.int64)
+
+
+def find_singles_numpy(masks: np.ndarray, size: int) -> np.ndarray:
+    naked = (masks != 0) & ((masks & (masks - 1)) == 0)
+    xs, ys = np.nonzero(naked)
+    singles = [np.stack((xs, ys, np.log2(masks[xs, ys]).astype(np.int64)), axis=1)]
+
+    counts = unit_digit_counts(masks, size)
+    box_x, box_y = box_cells(size)
+    for unit in range(3):
+        us, values = np.nonzero(counts[unit] == 1)
+        units = np.repeat(us[:, None], size * size, axis=1)
+        positions = np.tile(np.arange(size * size), (len(us), 1))
+        if unit == 0:
+            cells_x, cells_y = units, positions
+        elif unit == 1:
+            cells_x, cells_y = positions, units
+        else:
+            cells_x, cells_y = box_x[us], box_y[us]
+        found = ((masks[cells_x, cells_y] >> values[:, None]) & 1).argmax(axis=1)
+        rows = np.arange(len(us))
+        singles.append(
+            np.stack((cells_x[rows, found], cells_y[rows, found], values), axis=1)
+        )
+    return np.concatenate(singles).astype(np.int64).reshape(-1, 3)
+
+
+def propagate_numpy(sudoku_map: np.ndarray, size: int) -> tuple:
+    current = sudoku_map.copy()
+    masks = candidate_masks(current, size)
+    while True:
+        if np.any((current == 0) & (masks == 0)):
+            return current, masks, False
+
+        singles = find_singles(masks, size)
+        if not len(singles):
+            return current, masks, True
+        for x, y, value in singles:
+            if current[x, y] == value:
+                continue
+            if current[x, y] or not (masks[x, y] >> value) & 1:
+                return current, masks, False
+            current[x, y] = value
+            eliminate(masks, x, y, value, size)
+
+
+if BACKEND == "numba":
+    unit_cell = numba.njit(cache=True)(unit_cell)
+    candidate_masks = numba.njit(cache=True)(candidate_masks_loops)
+    eliminate = numba.njit(cache=True)(eliminate_loops)
+    unit_digit_counts = numba.njit(cache=True)(unit_digit_counts_loops)
+    candidate_counts = numba.njit(cache=True)(candidate_counts_loops)
+    find_singles = numba.njit(cache=True)(find_singles_loops)
+    propagate = numba.njit(cache=True)(propagate_loops)
+else:
+    candidate_masks = candidate_masks_numpy
+    eliminate = eliminate_numpy
+    unit_digit_counts = unit_digit_counts_numpy
+    candidate_counts = candidate_counts_numpy
+    find_singles = find_singles_numpy
+    propagate = propagate_numpy
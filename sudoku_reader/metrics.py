@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""Metrics and tracing.
+
+This module provides counters and histograms rendered in the Prometheus text
+exposition format, and traces timing the stages of a single request.
+
+"""
+import bisect
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Counter:
+    """
+    A monotonically increasing counter, optionally split by labels.
+    """
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    A histogram of observed values, optionally split by labels.
+    """
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = None):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets or self.DEFAULT_BUCKETS)
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            # The last count is the one of the implicit +Inf bucket.
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels) -> int:
+        counts, _ = self._values.get(tuple(sorted(labels.items())), ([], 0))
+        return sum(counts)
+
+    def render(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulated = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulated += count
+                    labels = format_labels(key + (("le", bound),))
+                    lines.append(f"{self.name}_bucket{labels} {cumulated}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{format_labels(key)} {cumulated}")
+        return lines
+
+
+class Registry:
+    """
+    A set of metrics rendered together.
+    """
+
+    def __init__(self):
+        self.metrics = list()
+        self.collectors = list()
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        counter = Counter(name, documentation)
+        self.metrics.append(counter)
+        return counter
+
+    def histogram(
+        self, name: str, documentation: str, buckets: tuple = None
+    ) -> Histogram:
+        histogram = Histogram(name, documentation, buckets)
+        self.metrics.append(histogram)
+        return histogram
+
+    def add_collector(self, collector: callable):
+        """
+        Add a function called at each rendering, returning exposition lines.
+
+        Parameters
+        ----------
+        collector : callable
+
+        Returns
+        -------
+        None
+        """
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        """
+        Render the metrics in the Prometheus text exposition format.
+
+        Returns
+        -------
+        str
+        """
+        lines = list()
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "sudoku_stage_seconds", "Time spent in each stage of the picture pipeline."
+)
+
+
+class Trace:
+    """
+    Timings of the stages of a single request.
+
+    A trace only contains builtin values, so it can be sent to and back from
+    a worker process.
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.stages = list()
+        self.observed = 0
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time the enclosed block as the given stage.
+
+        Parameters
+        ----------
+        name : str
+
+        Returns
+        -------
+        None
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.perf_counter() - start))
+
+    def extend(self, stages: list):
+        self.stages.extend(stages)
+
+    def observe(self, histogram: Histogram = STAGE_SECONDS):
+        """
+        Record the stage timings not recorded yet in a histogram labeled by
+        stage.
+
+        Parameters
+        ----------
+        histogram : Histogram, optional
+
+        Returns
+        -------
+        None
+        """
+        for name, duration in self.stages[self.observed :]:
+            histogram.observe(duration, stage=name)
+        self.observed = len(self.stages)
+
+    def server_timing(self) -> str:
+        """
+        Format the trace as a Server-Timing HTTP header value.
+
+        Returns
+        -------
+        str
+        """
+        return ", ".join(
+            f"{name};dur={duration * 1000:.1f}" for name, duration in self.stages
+        )
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "stages": [
+                {"stage": name, "seconds": duration} for name, duration in self.stages
+            ],
+        }
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""Parallel search.
+
+This module splits the top levels of the search tree of a single grid into
+subproblems solved by a pool of worker processes. The first solution found
+stops the workers; when counting the solutions, the counts of all the
+subproblems are summed.
+
+"""
+import os
+import queue
+import time
+
+import numpy as np
+
+from sudoku_reader.algorithms import (
+    SearchStatistics,
+    count_solutions,
+    minimum_remaining_value,
+    recursive_backtracking,
+    unorder_domain_values,
+)
+from sudoku_reader.csp import SudokuCSP, is_consistent_map
+from sudoku_reader.portfolio import get_context
+
+
+def split_search(
+    csp: SudokuCSP,
+    count: int,
+    select_unassigned_variable=minimum_remaining_value,
+    order_domain_values=unorder_domain_values,
+) -> tuple:
+    """
+    Expand the top levels of the search tree breadth first.
+
+    Parameters
+    ----------
+    csp : SudokuCSP
+    count : int
+        Number of subproblems to reach.
+    select_unassigned_variable : callable
+    order_domain_values : callable
+
+    Returns
+    -------
+    tuple of (list, list)
+        The complete assignments met while splitting, and the partial
+        assignments of the subproblems, in the order of the search.
+    """
+    solutions = list()
+    frontier = [csp.apply_constraints()]
+    while frontier and len(frontier) < count:
+        expanded = list()
+        for assignment in frontier:
+            if len(assignment) == len(csp.variables):
+                solutions.append(assignment)
+                continue
+            var = select_unassigned_variable(assignment, csp)
+            for value in order_domain_values(var, assignment, csp):
+                if not csp.conflicts(assignment, var, value):
+                    expanded.append(assignment | {var: value})
+        frontier = expanded
+    return solutions, frontier
+
+
+def search_worker(
+    sudoku_map: np.ndarray,
+    tasks,
+    results,
+    select_unassigned_variable,
+    order_domain_values,
+    counting: bool,
+):
+    """
+    Solve subproblems until the task queue is exhausted. Executed in a worker
+    process.
+
+    Parameters
+    ----------
+    sudoku_map : np.ndarray
+    tasks : multiprocessing.Queue
+        (index, assignment) subproblems, then None.
+    results : multiprocessing.Queue
+        Receives (index, solution map or solution count, statistics).
+    select_unassigned_variable : callable
+    order_domain_values : callable
+    counting : bool
+        Count the solutions of the subproblems instead of finding one.
+
+    Returns
+    -------
+    None
+    """
+    # The CSP is built once, as it is long to build for large grids.
+    csp = SudokuCSP(sudoku_map)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        index, assignment = task
+        statistics = SearchStatistics()
+        if counting:
+            result = count_solutions(
+                csp,
+                select_unassigned_variable,
+                order_domain_values,
+                statistics,
+                assignment,
+            )
+        else:
+            result = recursive_backtracking(
+                dict(assignment),
+                csp,
+                select_unassigned_variable,
+                order_domain_values,
+                statistics,
+            )
+            if result is not None:
+                result = csp.get_resulted_map(result)
+        results.put((index, result, statistics.as_dict()))
+
+
+def solve_parallel(
+    sudoku_map: np.ndarray,
+    workers: int = None,
+    subproblems: int = None,
+    select_unassigned_variable=minimum_remaining_value,
+    order_domain_values=unorder_domain_values,
+    counting: bool = False,
+    statistics: SearchStatistics = None,
+    timeout: float = None,
+):
+    """
+    Solve a grid, or count its solutions, with a pool of worker processes.
+
+    Parameters
+    ----------
+    sudoku_map : np.ndarray
+        A N x N array (empty => 0).
+    workers : int, optional
+        Number of worker processes. Defaults to the number of CPUs.
+    subproblems : int, optional
+        Minimum number of subproblems. Defaults to 8 per worker, so that
+        workers finishing early get more work.
+    select_unassigned_variable : callable, optional
+        How the variables are sorted, a picklable function.
+    order_domain_values : callable, optional
+        How the domain is sorted, a picklable function.
+    counting : bool, optional
+        Count the solutions instead of finding one.
+    statistics : SearchStatistics, optional
+        Filled with the counters of all the workers.
+    timeout : float, optional
+        Maximum time in seconds to wait for the workers.
+
+    Returns
+    -------
+    np.ndarray or None if the map has no solution, or the number of solutions
+    when counting.
+
+    Raises
+    ------
+    TimeoutError
+        If the workers didn't finish in time.
+    """
+    if not is_consistent_map(sudoku_map):
+        return 0 if counting else None
+
+    workers = workers or os.cpu_count()
+    csp = SudokuCSP(sudoku_map)
+    solutions, frontier = split_search(
+        csp,
+        subproblems or 8 * workers,
+        select_unassigned_variable,
+        order_domain_values,
+    )
+    if solutions and not counting:
+        return csp.get_resulted_map(solutions[0])
+    if not frontier:
+        return len(solutions) if counting else None
+
+    context = get_context()
+    tasks, results = context.Queue(), context.Queue()
+    for index, assignment in enumerate(frontier):
+        tasks.put((index, assignment))
+    for _ in range(workers):
+        tasks.put(None)
+
+    processes = [
+        context.Process(
+            target=search_worker,
+            args=(
+                sudoku_map,
+                tasks,
+                results,
+                select_unassigned_variable,
+                order_domain_values,
+                counting,
+            ),
+        )
+        for _ in range(workers)
+    ]
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    total, remaining = len(solutions), len(frontier)
+
+    try:
+        for process in processes:
+            process.start()
+        while remaining:
+            alive = any(process.is_alive() for process in processes)
+            try:
+                _, result, worker_statistics = results.get(timeout=0.1)
+            except queue.Empty:
+                if not alive:
+                    raise RuntimeError("The search workers stopped unexpectedly.")
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError("The search didn't finish in time.")
+                continue
+
+            remaining -= 1
+            if statistics is not None:
+                for name, value in worker_statistics.items():
+                    setattr(statistics, name, getattr(statistics, name) + value)
+            if counting:
+                total += result
+            elif result is not None:
+                return result
+        return total if counting else None
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        # The tasks not taken by the workers are still buffered in the queue:
+        # don't wait for them to be written to a pipe that no one reads.
+        tasks.cancel_join_thread()
+        tasks.close()
+        results.close()
@@ -1,18 +1,145 @@
 """
 Picture treatment module.
 """
+import functools
+import io
+from enum import Enum
+
 import numpy as np
 import skimage.color
 import skimage.filters
 import skimage.io
+import skimage.transform
+import skimage.util
 from scipy import ndimage, spatial
 from scipy.signal import argrelextrema
 from PIL import Image, ImageDraw, ImageFont
 import cv2
 import imutils
 
+from sudoku_reader.metrics import Trace
+
+
+class BinarizationMethod(Enum):
+    SAUVOLA = "sauvola"
+    INTEGRAL = "integral"
+    OPENCV = "opencv"
+
+
+def decode_picture(data: bytes) -> np.ndarray:
+    """
+    Decode an encoded (PNG, JPEG, ...) picture from memory.
+
+    Parameters
+    ----------
+    data : bytes
+
+    Returns
+    -------
+    N x M x 3 RGB matrix.
+    """
+    picture = cv2.imdecode(
+        np.frombuffer(data, dtype=np.uint8),
+        cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION,
+    )
+    if picture is None:
+        raise ValueError("The data can't be decoded as a picture.")
+    return cv2.cvtColor(picture, cv2.COLOR_BGR2RGB)
+
+
+def to_grey(picture: np.ndarray) -> np.ndarray:
+    """
+    Convert a picture to a 8-bit grey level picture.
+
+    Parameters
+    ----------
+    picture : np.ndarray
+        A N x M grey, RGB or RGBA matrix.
+    Returns
+    -------
+    N x M uint8 matrix.
+    """
+    if picture.dtype != np.uint8:
+        picture = skimage.util.img_as_ubyte(picture)
+    if picture.ndim == 2:
+        return picture
+    if picture.shape[2] == 4:
+        return cv2.cvtColor(picture, cv2.COLOR_RGBA2GRAY)
+    return cv2.cvtColor(picture, cv2.COLOR_RGB2GRAY)
+
+
+def downscale(picture: np.ndarray, max_size: int) -> tuple:
+    """
+    Downscale a picture so that its largest side is at most `max_size` pixels.
+
+    Parameters
+    ----------
+    picture : np.ndarray
+    max_size : int
+
+    Returns
+    -------
+    tuple of (np.ndarray, float)
+        The downscaled picture and the applied scale factor (<= 1).
+    """
+    height, width = picture.shape[:2]
+    scale = max_size / max(height, width)
+    if scale >= 1:
+        return picture, 1.0
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(picture, size, interpolation=cv2.INTER_AREA), scale
+
 
-def binarize(picture: np.ndarray) -> np.ndarray:
+def integral_threshold(
+    grey_img: np.ndarray, window_size: int = 71, k: float = 0.1
+) -> np.ndarray:
+    """
+    Compute the Sauvola threshold of a grey picture using integral images.
+
+    The local mean and standard deviation of each window are read from two
+    summed-area tables, so the cost does not depend on the window size.
+
+    Parameters
+    ----------
+    grey_img : np.ndarray
+        A N x M uint8 matrix.
+    window_size : int
+        Odd size of the local window.
+    k : float
+
+    Returns
+    -------
+    N x M float matrix.
+    """
+    half = window_size // 2
+    height, width = grey_img.shape
+    padded = np.pad(grey_img.astype(np.float64), half + 1, mode="reflect")
+
+    integral = padded.cumsum(axis=0).cumsum(axis=1)
+    np.square(padded, out=padded)
+    integral_sq = padded.cumsum(axis=0).cumsum(axis=1)
+
+    def window_sum(table):
+        return (
+            table[window_size : window_size + height, window_size : window_size + width]
+            - table[:height, window_size : window_size + width]
+            - table[window_size : window_size + height, :width]
+            + table[:height, :width]
+        )
+
+    area = window_size ** 2
+    mean = window_sum(integral) / area
+    std = np.sqrt(np.clip(window_sum(integral_sq) / area - mean ** 2, 0, None))
+    return mean * (1 + k * (std / 255 - 1))
+
+
+def binarize(
+    picture: np.ndarray,
+    method: BinarizationMethod = BinarizationMethod.SAUVOLA,
+    max_size: int = None,
+    window_size: int = 71,
+    k: float = 0.1,
+) -> np.ndarray:
     """
     Binarize the given picture.
 
@@ -20,18 +147,67 @@ def binarize(picture: np.ndarray) -> np.ndarray:
     ----------
     picture : np.ndarray
         A N X M color matrix.
+    method : BinarizationMethod, optional
+        SAUVOLA uses scikit-image, INTEGRAL computes the same threshold with
+        integral images and OPENCV uses the OpenCV adaptive mean threshold.
+    max_size : int, optional
+        If given, the picture is first downscaled so that its largest side is
+        at most `max_size` pixels, and the window size is scaled accordingly.
+    window_size : int, optional
+        Size of the local window at full resolution.
+    k : float, optional
     Returns
     -------
-    N x M binary matrix.
+    N x M binary uint8 matrix (or smaller if `max_size` is given).
     """
-    width, height, _ = picture.shape
-    grey_img = skimage.color.rgb2gray(picture)
+    if method is BinarizationMethod.SAUVOLA and max_size is None:
+        grey_img = skimage.color.rgb2gray(picture)
+        threshold_image = skimage.filters.threshold_sauvola(
+            grey_img, window_size=window_size, k=k
+        )
+        return (grey_img < threshold_image).astype(np.uint8)
+
+    grey_img = to_grey(picture)
+    if max_size is not None:
+        grey_img, scale = downscale(grey_img, max_size)
+        window_size = max(3, int(window_size * scale) | 1)
+
+    if method is BinarizationMethod.OPENCV:
+        # The offset matches Sauvola's threshold on a flat mid-grey window.
+        return cv2.adaptiveThreshold(
+            grey_img,
+            1,
+            cv2.ADAPTIVE_THRESH_MEAN_C,
+            cv2.THRESH_BINARY_INV,
+            window_size,
+            round(k * 127.5),
+        )
 
-    threshold_image = skimage.filters.threshold_sauvola(grey_img, window_size=71, k=0.1)
-    return np.where(grey_img < threshold_image, np.ones((width, height)), 0)
+    if method is BinarizationMethod.SAUVOLA:
+        threshold_image = skimage.filters.threshold_sauvola(
+            grey_img, window_size=window_size, k=k, r=255
+        )
+    else:
+        threshold_image = integral_threshold(grey_img, window_size, k)
 
+    binarized_img = np.empty(grey_img.shape, dtype=np.uint8)
+    np.less(grey_img, threshold_image, out=binarized_img.view(np.bool_))
+    return binarized_img
 
-def perspective_transform(binarized_img: np.ndarray) -> np.ndarray:
+
+def get_grid_corners(binarized_img: np.ndarray) -> np.ndarray:
+    """
+    Find the corners of the largest quadrilateral contour of a binary picture.
+
+    Parameters
+    ----------
+    binarized_img : np.ndarray
+        A N x M binary matrix.
+    Returns
+    -------
+    4 x 2 float32 matrix of (x, y) corners ordered as top-left, top-right,
+    bottom-right and bottom-left.
+    """
     binarized_img = binarized_img.astype("uint8")
     cnts = cv2.findContours(
         binarized_img.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
@@ -48,14 +224,51 @@ def perspective_transform(binarized_img: np.ndarray) -> np.ndarray:
             puzzleCnt = approx.reshape((4, 2)).astype("float32")
             break
 
+    if puzzleCnt is None:
+        raise ValueError("No grid contour found in the picture.")
+
     (tl, bl, br, tr) = puzzleCnt
-    rect = np.array([tl, tr, br, bl])
-    distances = spatial.distance.cdist(rect, rect)
+    return np.array([tl, tr, br, bl])
 
-    maxWidth = max(int(distances[0, 1]), int(distances[2, 3]))
-    maxHeight = max(int(distances[0, 3]), int(distances[2, 3]))
 
-    margin = 50
+def warp_grid(
+    picture: np.ndarray,
+    corners: np.ndarray,
+    max_size: int = None,
+    margin: int = 50,
+    size: tuple = None,
+) -> np.ndarray:
+    """
+    Warp the grid delimited by the given corners to a straight picture.
+
+    Parameters
+    ----------
+    picture : np.ndarray
+    corners : np.ndarray
+        Corners of the grid, as returned by `get_grid_corners`.
+    max_size : int, optional
+        If given, the largest side of the warped picture is at most `max_size`
+        pixels.
+    margin : int, optional
+        Margin around the grid in the warped picture.
+    size : tuple of int, optional
+        Fixed (width, height) of the warped picture. Computed from the corners
+        if not given.
+    Returns
+    -------
+    np.ndarray
+    """
+    if size is not None:
+        maxWidth, maxHeight = size
+    else:
+        distances = spatial.distance.cdist(corners, corners)
+
+        maxWidth = max(int(distances[0, 1]), int(distances[2, 3]))
+        maxHeight = max(int(distances[0, 3]), int(distances[2, 3]))
+
+        if max_size is not None and max(maxWidth, maxHeight) > max_size:
+            scale = max_size / max(maxWidth, maxHeight)
+            maxWidth, maxHeight = int(maxWidth * scale), int(maxHeight * scale)
 
     dst = np.array(
         [
@@ -67,11 +280,16 @@ def perspective_transform(binarized_img: np.ndarray) -> np.ndarray:
         dtype="float32",
     )
 
-    M = cv2.getPerspectiveTransform(rect, dst)
-    return cv2.warpPerspective(binarized_img, M, (maxWidth, maxHeight))
+    M = cv2.getPerspectiveTransform(corners.astype("float32"), dst)
+    return cv2.warpPerspective(picture, M, (maxWidth, maxHeight))
 
 
-def binary_dilatation(picture: np.ndarray) -> np.ndarray:
+def perspective_transform(binarized_img: np.ndarray) -> np.ndarray:
+    binarized_img = binarized_img.astype("uint8")
+    return warp_grid(binarized_img, get_grid_corners(binarized_img))
+
+
+def binary_dilatation(picture: np.ndarray, iterations: int = 3) -> np.ndarray:
     """
     Dilate a binary picture.
 
@@ -79,11 +297,123 @@ def binary_dilatation(picture: np.ndarray) -> np.ndarray:
     ----------
     picture : np.ndarray
         A N x M binary matrix.
+    iterations : int, optional
     Returns
     -------
     N x M binary matrix.
     """
-    return ndimage.binary_dilation(picture, iterations=3).astype(picture.dtype)
+    return ndimage.binary_dilation(picture, iterations=iterations).astype(
+        picture.dtype
+    )
+
+
+def binary_downscale(binarized_img: np.ndarray, max_size: int) -> tuple:
+    """
+    Downscale a binary picture like a max-pool: a pixel of the level is
+    foreground when any pixel of the area it covers is, so that thin grid
+    lines are preserved. Meant for pictures that are dilated anyway.
+
+    Parameters
+    ----------
+    binarized_img : np.ndarray
+        A N x M binary matrix.
+    max_size : int
+
+    Returns
+    -------
+    tuple of (np.ndarray, float)
+        The downscaled uint8 binary picture and the applied scale factor.
+    """
+    level, scale = downscale(binarized_img.astype(np.uint8) * 255, max_size)
+    return (level > 0).astype(np.uint8), scale
+
+
+def locate_grid(binarized_img: np.ndarray, max_size: int = 800) -> np.ndarray:
+    """
+    Find the grid corners on a downsampled level of the binary picture.
+
+    Parameters
+    ----------
+    binarized_img : np.ndarray
+        A N x M binary matrix.
+    max_size : int, optional
+        Largest side of the level where the contour search runs.
+    Returns
+    -------
+    4 x 2 float32 matrix of corners in the coordinates of `binarized_img`.
+    """
+    level, scale = binary_downscale(binarized_img, max_size)
+    level = binary_dilatation(level, iterations=max(1, round(3 * scale)))
+    return get_grid_corners(level) / scale
+
+
+def get_grid_lines(grid_picture: np.ndarray, max_size: int = 800) -> tuple:
+    """
+    Find the rows and columns of a warped grid on a downsampled level.
+
+    Parameters
+    ----------
+    grid_picture : np.ndarray
+        A warped and dilated N x M binary matrix.
+    max_size : int, optional
+        Largest side of the level where the spikes are searched.
+    Returns
+    -------
+    tuple of (np.ndarray, np.ndarray)
+        Rows and columns positions in the coordinates of `grid_picture`.
+    """
+    level, scale = binary_downscale(grid_picture, max_size)
+    level = get_largest_connected_components(level)
+
+    x_proj = get_highest_spikes(level, n=10, axis=0)
+    y_proj = get_highest_spikes(level, n=10, axis=1)
+
+    return (
+        np.round(y_proj / scale).astype(int),
+        np.round(x_proj / scale).astype(int),
+    )
+
+
+def extract_digit_pictures(
+    picture: np.ndarray,
+    detection_size: int = 1200,
+    warp_size: int = 1600,
+    trace: Trace = None,
+) -> list:
+    """
+    Get the digits pictures of a sudoku photo.
+
+    The photo is binarized at full resolution with the default method. The
+    grid contour and lines are then searched on downsampled levels of the
+    binary picture, and the cells are cut from its warp.
+
+    Parameters
+    ----------
+    picture : np.ndarray
+        A N x M color matrix.
+    detection_size : int, optional
+        Largest side of the levels used for the grid detection.
+    warp_size : int, optional
+        Largest side of the warped grid picture.
+    trace : Trace, optional
+        Trace where the binarize, warp and segmentation stages are timed.
+    Returns
+    -------
+    list of tuple
+    """
+    trace = trace or Trace()
+
+    with trace.stage("binarize"):
+        bin_picture = binarize(picture)
+
+    with trace.stage("warp"):
+        corners = locate_grid(bin_picture, detection_size)
+        bin_picture = warp_grid(bin_picture, corners, max_size=warp_size)
+        bin_picture = binary_dilatation(bin_picture)
+
+    with trace.stage("segmentation"):
+        rows, cols = get_grid_lines(bin_picture, detection_size)
+        return filter_digit_pictures(bin_picture, rows, cols)
 
 
 def get_largest_connected_components(picture: np.ndarray):
@@ -201,18 +531,94 @@ def filter_digit_pictures(
     return digits
 
 
-def create_grid_picture(digits: list, file_path: str, size: int = 900):
+def filter_cells(digits: list):
     """
-    Create a sudoku png picture from the given digits list.
+    Filter each given cell to isolate and center the digit in 28x28 binary array.
 
     Parameters
     ----------
-    digits : list
-        Flatten array of digits (empty => 0)
-    file_path : str
-        Path of the picture.
-    size : int, optional
+    digits : array of ((x, y), binary_image)
+
+    Returns
+    -------
+    An array of the same shape than the given array.
+    """
+    filtered_digits = digits.copy()
+
+    for i in range(len(digits)):
+        img = np.where(filtered_digits[i][1] == 0.0, filtered_digits[i][1], 1.0)
+
+        labeled_img, nb_labels = ndimage.label(img)
+        sizes = ndimage.sum_labels(img, labeled_img, range(nb_labels + 1))
+
+        digit_label = np.argmax(sizes)
+        digit_slice = ndimage.find_objects(labeled_img == digit_label)[0]
+        img = skimage.transform.resize(img[digit_slice], (18, 18), anti_aliasing=False)
+
+        template = np.zeros((28, 28))
+        width, height = img.shape
+        padding_x = int((28 - width) / 2)
+        padding_y = int((28 - height) / 2)
+
+        template[padding_x : padding_x + width, padding_y : padding_y + height] = img
+
+        filtered_digits[i][1] = template.astype('uint8')
+
+    return filtered_digits
+
+
+def read_cells(data: bytes) -> tuple:
+    """
+    Get the normalized cell pictures of an encoded picture.
+
+    Parameters
+    ----------
+    data : bytes
+
+    Returns
+    -------
+    tuple of (array of ((x, y), 28x28 binary image), list of stage timings)
+    """
+    trace = Trace()
+    with trace.stage("decode"):
+        picture = decode_picture(data)
+    digits = extract_digit_pictures(picture, trace=trace)
+    with trace.stage("normalization"):
+        digits = filter_cells(digits)
+    return digits, trace.stages
+
+
+@functools.lru_cache(maxsize=16)
+def load_font(size: int) -> ImageFont.FreeTypeFont:
+    """
+    Load the font used to draw the digits, once per size.
+
+    Parameters
+    ----------
+    size : int
+
+    Returns
+    -------
+    ImageFont.FreeTypeFont
+    """
+    return ImageFont.truetype("arial", size)
+
+
+@functools.lru_cache(maxsize=8)
+def grid_template(size: int) -> Image.Image:
+    """
+    Draw an empty sudoku grid, once per size.
+
+    The returned picture is shared and must not be modified.
+
+    Parameters
+    ----------
+    size : int
         Size of the picture in pixels.
+
+    Returns
+    -------
+    PIL.Image.Image
     """
     img = Image.new("RGB", (size, size), color="white")
     draw = ImageDraw.Draw(img)
@@ -239,23 +645,105 @@ def create_grid_picture(digits: list, file_path: str, size: int = 900):
             fill=(0, 0, 0),
             width=line_width,
         )
+    return img
+
 
-    font = ImageFont.truetype("arial", int(cell_width * 0.8))
+@functools.lru_cache(maxsize=128)
+def digit_glyph(digit: int, cell_width: int) -> Image.Image:
+    """
+    Render a digit centered in a cell sized mask, once per digit and size.
+
+    Parameters
+    ----------
+    digit : int
+    cell_width : int
+
+    Returns
+    -------
+    PIL.Image.Image
+        A cell_width x cell_width "L" mask.
+    """
+    glyph = Image.new("L", (cell_width, cell_width), color=0)
+    ImageDraw.Draw(glyph).text(
+        (cell_width / 2, cell_width / 2),
+        str(digit),
+        255,
+        align="center",
+        font=load_font(int(cell_width * 0.8)),
+        anchor="mm",
+    )
+    return glyph
+
+
+def create_grid_picture(digits: list, file_path: str = None, size: int = 900):
+    """
+    Create a sudoku png picture from the given digits list.
+
+    Parameters
+    ----------
+    digits : list
+        Flatten array of digits (empty => 0)
+    file_path : str, optional
+        Path of the picture. If not given, the picture is only returned.
+    size : int, optional
+        Size of the picture in pixels.
+
+    Returns
+    -------
+    PIL.Image.Image
+    """
+    img = grid_template(size).copy()
+    margin = 0.05 * size
+    cell_width = int((size - 2 * margin) / 9)
 
     i = -1
-    margin = margin + int(cell_width / 2)
     for y in range(0, 9):
         for x in range(0, 9):
             i += 1
             if digits[i] == 0:
                 continue
-            draw.text(
-                (margin + x * cell_width, margin + y * cell_width),
-                str(digits[i]),
+            img.paste(
                 (0, 0, 0),
-                align="center",
-                font=font,
-                anchor="mm",
+                (round(margin + x * cell_width), round(margin + y * cell_width)),
+                mask=digit_glyph(int(digits[i]), cell_width),
             )
 
-    img.save(file_path)
+    if file_path is not None:
+        img.save(file_path)
+    return img
+
+
+def encode_grid_picture(
+    digits: list,
+    size: int = 900,
+    image_format: str = "PNG",
+    compress_level: int = 1,
+    quality: int = 80,
+) -> bytes:
+    """
+    Create a sudoku picture from the given digits list and encode it in memory.
+
+    Parameters
+    ----------
+    digits : list
+        Flatten array of digits (empty => 0)
+    size : int, optional
+        Size of the picture in pixels.
+    image_format : str, optional
+        "PNG" or "WEBP".
+    compress_level : int, optional
+        PNG zlib compression level, from 0 (fastest) to 9 (smallest).
+    quality : int, optional
+        WebP quality, from 0 to 100.
+
+    Returns
+    -------
+    bytes
+    """
+    output = io.BytesIO()
+    img = create_grid_picture(digits, size=size)
+    if image_format.upper() == "WEBP":
+        img.save(output, format="WEBP", quality=quality)
+    else:
+        img.save(output, format="PNG", compress_level=compress_level)
+    return output.getvalue()
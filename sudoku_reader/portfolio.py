@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Portfolio solving.
+
+This module races several solving strategies on the same grid, each in its
+own process, and keeps the first result. As every strategy is a complete
+search, the first result is the answer: either a solution, or the proof that
+there is none. The other processes are then terminated.
+
+"""
+import multiprocessing
+import queue
+import time
+
+import numpy as np
+
+from sudoku_reader.algorithms import SearchStatistics, solve_sudoku
+from sudoku_reader.interfaces import AlgorithmType
+
+PORTFOLIO = (
+    AlgorithmType.AC3,
+    AlgorithmType.MRV,
+    AlgorithmType.MRV_RESTARTS,
+    AlgorithmType.LEAST_CONSTRAINING_H,
+    AlgorithmType.DEGREE_H,
+)
+
+# The strategies whose search depends on a seed.
+RANDOMIZED = (AlgorithmType.MRV_RESTARTS,)
+
+
+def get_context():
+    # The fork server starts the strategy processes quickly and safely, even
+    # from a multithreaded process, where it is available.
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["sudoku_reader.algorithms"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def run_strategy(
+    sudoku_map: np.ndarray, algorithm_type: AlgorithmType, results, seed: int = None
+) -> None:
+    """
+    Solve a grid with one strategy and put the result in a queue. Executed in
+    a strategy process.
+
+    Parameters
+    ----------
+    sudoku_map : np.ndarray
+    algorithm_type : AlgorithmType
+    results : multiprocessing.Queue
+        Receives (algorithm name, solution or None, statistics).
+    seed : int, optional
+        Seed of a randomized strategy.
+
+    Returns
+    -------
+    None
+    """
+    statistics = SearchStatistics()
+    options = {"seed": seed} if algorithm_type in RANDOMIZED else {}
+    solution = solve_sudoku(sudoku_map, algorithm_type, statistics, **options)
+    results.put((algorithm_type.name, solution, statistics.as_dict()))
+
+
+def solve_portfolio(
+    sudoku_map: np.ndarray,
+    algorithm_types: tuple = PORTFOLIO,
+    timeout: float = None,
+    seed: int = None,
+) -> tuple:
+    """
+    Solve a grid with several strategies in parallel.
+
+    Parameters
+    ----------
+    sudoku_map : np.ndarray
+        A N x N array (empty => 0).
+    algorithm_types : tuple of AlgorithmType, optional
+        The strategies to race.
+    timeout : float, optional
+        Maximum time in seconds to wait for a result.
+    seed : int, optional
+        Seed from which each process gets its own seed, so that the same
+        randomized strategy run twice explores different orders.
+
+    Returns
+    -------
+    tuple of (np.ndarray, AlgorithmType, dict)
+        The solution (None if the map has no solution), the strategy that
+        answered first and its search statistics.
+
+    Raises
+    ------
+    TimeoutError
+        If no strategy answered in time.
+    """
+    if AlgorithmType.PORTFOLIO in algorithm_types:
+        raise ValueError("A portfolio can't contain itself.")
+
+    context = get_context()
+    results = context.Queue()
+    seeds = np.random.SeedSequence(seed).generate_state(len(algorithm_types))
+    processes = [
+        context.Process(
+            target=run_strategy,
+            args=(sudoku_map, algorithm_type, results, int(process_seed)),
+        )
+        for algorithm_type, process_seed in zip(algorithm_types, seeds)
+    ]
+    deadline = time.monotonic() + timeout if timeout is not None else None
+
+    try:
+        for process in processes:
+            process.start()
+        while True:
+            # Checked before waiting, so that the result of a strategy that
+            # just exited is still read.
+            alive = any(process.is_alive() for process in processes)
+            try:
+                name, solution, statistics = results.get(timeout=0.1)
+                return solution, AlgorithmType[name], statistics
+            except queue.Empty:
+                if not alive:
+                    raise RuntimeError("All the strategies failed.")
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError("No strategy found a result in time.")
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        results.close()
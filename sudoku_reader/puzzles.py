@@ -0,0 +1,509 @@
+# -*- coding: utf-8 -*-
+"""Puzzle representations.
+
+This module converts sudoku maps from and to their text representations, and
+stores them in compact binary puzzle files.
+
+"""
+import csv
+import json
+import math
+import os
+
+import numpy as np
+
+
+def parse_grid(value) -> np.ndarray:
+    """
+    Parse a grid given as a string ("0" or "." for empty cells) or as an array.
+
+    Parameters
+    ----------
+    value : str or list
+        Grids larger than 9 x 9 must be given as arrays, their values having
+        several digits.
+
+    Returns
+    -------
+    np.ndarray
+    """
+    if isinstance(value, str):
+        value = [0 if ch in "0." else int(ch) for ch in value.strip()]
+        if len(value) > 81:
+            raise ValueError("Grids larger than 9 x 9 must be given as arrays.")
+
+    sudoku_map = np.array(value, dtype=int)
+    if sudoku_map.ndim == 1:
+        length = math.isqrt(len(sudoku_map))
+        if length ** 2 != len(sudoku_map):
+            raise ValueError("The grid must have a square number of cells.")
+        sudoku_map = sudoku_map.reshape((length, length))
+
+    length = len(sudoku_map)
+    if (
+        sudoku_map.ndim != 2
+        or sudoku_map.shape[1] != length
+        or math.isqrt(length) ** 2 != length
+        or length == 0
+    ):
+        raise ValueError("The grid must be a N x N array with N a square number.")
+    if sudoku_map.min() < 0 or sudoku_map.max() > length:
+        raise ValueError(f"The grid values must be between 0 and {length}.")
+    return sudoku_map
+
+
+def format_grid(sudoku_map: np.ndarray):
+    """
+    Format a grid as a string of digits, "0" for empty cells.
+
+    Parameters
+    ----------
+    sudoku_map : np.ndarray
+        A N x N array.
+
+    Returns
+    -------
+    str, or list of rows if N > 9 as the digits can't be told apart.
+    """
+    sudoku_map = np.asarray(sudoku_map)
+    if len(sudoku_map) > 9:
+        return sudoku_map.tolist()
+    return "".join(str(digit) for digit in sudoku_map.flatten())
+
+
+MAGIC = b"SUDOKUPZ"
+HEADER_ALIGNMENT = 64
+
+
+def cell_bits(length: int) -> int:
+    """
+    Get the default number of bits used to store a cell of a grid.
+
+    Parameters
+    ----------
+    length : int
+        The length of the grid.
+
+    Returns
+    -------
+    int
+        4 if the digits fit in a nibble, 8 otherwise.
+    """
+    return 4 if length < 16 else 8
+
+
+def record_dtype(length: int, bits: int, solution: bool, metadata: dict) -> np.dtype:
+    """
+    Get the dtype of the records of a puzzle file.
+
+    Parameters
+    ----------
+    length : int
+        The length of the grids.
+    bits : int
+        Number of bits per cell, 4 or 8.
+    solution : bool
+        Whether the records have a solution column.
+    metadata : dict
+        The dtype of each metadata column, by name.
+
+    Returns
+    -------
+    np.dtype
+    """
+    size = (length ** 2 * bits + 7) // 8
+    fields = [("grid", np.uint8, (size,))]
+    if solution:
+        fields.append(("solution", np.uint8, (size,)))
+    fields.extend((name, np.dtype(dtype)) for name, dtype in metadata.items())
+    return np.dtype(fields)
+
+
+def pack_grids(grids: np.ndarray, bits: int) -> np.ndarray:
+    """
+    Pack grids into bytes.
+
+    Parameters
+    ----------
+    grids : np.ndarray
+        A (N, L, L) array.
+    bits : int
+        Number of bits per cell, 4 or 8.
+
+    Returns
+    -------
+    np.ndarray
+        A (N, B) array of uint8.
+    """
+    cells = np.asarray(grids, dtype=np.uint8).reshape(len(grids), -1)
+    if bits == 8:
+        return cells
+    if cells.shape[1] % 2:
+        cells = np.pad(cells, ((0, 0), (0, 1)))
+    return (cells[:, 0::2] << 4) | cells[:, 1::2]
+
+
+def unpack_grids(packed: np.ndarray, length: int, bits: int) -> np.ndarray:
+    """
+    Unpack grids packed with `pack_grids`.
+
+    Parameters
+    ----------
+    packed : np.ndarray
+        A (N, B) array of uint8.
+    length : int
+        The length of the grids.
+    bits : int
+        Number of bits per cell, 4 or 8.
+
+    Returns
+    -------
+    np.ndarray
+        A (N, L, L) array of uint8. With 8 bits per cell, it is a view of
+        `packed`.
+    """
+    if bits == 8:
+        return packed.reshape(len(packed), length, length)
+    cells = np.empty((len(packed), packed.shape[1] * 2), dtype=np.uint8)
+    np.right_shift(packed, 4, out=cells[:, 0::2])
+    np.bitwise_and(packed, 0x0F, out=cells[:, 1::2])
+    return cells[:, : length ** 2].reshape(len(packed), length, length)
+
+
+def read_header(f) -> tuple:
+    """
+    Read the header of a puzzle file.
+
+    Parameters
+    ----------
+    f : file object
+        A binary file positioned at its beginning.
+
+    Returns
+    -------
+    tuple of (dict, int)
+        The header and its size in bytes.
+    """
+    start = f.read(len(MAGIC) + 4)
+    if len(start) < len(MAGIC) + 4 or start[: len(MAGIC)] != MAGIC:
+        raise ValueError("The file is not a puzzle file.")
+    size = int.from_bytes(start[len(MAGIC) :], "little")
+    header = json.loads(f.read(size - len(start)).decode("utf-8"))
+    if header.get("version") != 1:
+        raise ValueError(f"Unsupported puzzle file version {header.get('version')}.")
+    return header, size
+
+
+def write_header(f, header: dict) -> int:
+    """
+    Write the header of a puzzle file, padded so that the records are aligned.
+
+    Parameters
+    ----------
+    f : file object
+    header : dict
+
+    Returns
+    -------
+    int
+        The size of the header in bytes.
+    """
+    data = json.dumps(header).encode("utf-8")
+    size = len(MAGIC) + 4 + len(data)
+    size += -size % HEADER_ALIGNMENT
+    f.write(MAGIC + size.to_bytes(4, "little"))
+    f.write(data.ljust(size - len(MAGIC) - 4, b" "))
+    return size
+
+
+class PuzzleWriter:
+    """
+    Append puzzles to a puzzle file.
+
+    A puzzle file starts with a header describing its columns, followed by
+    fixed-size records holding a packed grid, an optional packed solution and
+    optional numeric metadata columns.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        length: int = 9,
+        solution: bool = False,
+        metadata: dict = None,
+        bits: int = None,
+    ):
+        """
+        Open a puzzle file for appending, creating it if it doesn't exist.
+
+        Parameters
+        ----------
+        file_path : str
+        length : int, optional
+            The length of the grids.
+        solution : bool, optional
+            Whether the records have a solution column.
+        metadata : dict, optional
+            The dtype of each metadata column, by name, e.g. {"difficulty": "u1"}.
+        bits : int, optional
+            Number of bits per cell, 4 or 8. Defaults to `cell_bits(length)`.
+
+        Raises
+        ------
+        ValueError
+            If the existing file has different columns.
+        """
+        header = {
+            "version": 1,
+            "length": length,
+            "bits": bits or cell_bits(length),
+            "solution": solution,
+            "metadata": {
+                name: np.dtype(dtype).str for name, dtype in (metadata or {}).items()
+            },
+        }
+        if header["bits"] not in (4, 8) or (header["bits"] == 4 and length > 15):
+            raise ValueError(f"Can't store grids of length {length} on 4 bits.")
+
+        if os.path.exists(file_path) and os.path.getsize(file_path):
+            with open(file_path, "rb") as f:
+                existing, header_size = read_header(f)
+            if existing != header:
+                raise ValueError(
+                    f"The file {file_path} has different columns: {existing}."
+                )
+            self.file = open(file_path, "r+b")
+            # Drop an incomplete record left by an interrupted write.
+            dtype = record_dtype(length, header["bits"], solution, header["metadata"])
+            count = (os.path.getsize(file_path) - header_size) // dtype.itemsize
+            self.file.truncate(header_size + count * dtype.itemsize)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.file = open(file_path, "wb")
+            write_header(self.file, header)
+
+        self.length = length
+        self.bits = header["bits"]
+        self.solution = solution
+        self.metadata = header["metadata"]
+        self.dtype = record_dtype(length, self.bits, solution, self.metadata)
+
+    def write(self, grids, solutions=None, **metadata):
+        """
+        Append puzzles in bulk.
+
+        Parameters
+        ----------
+        grids : array_like
+            A (N, L, L) array of grids, or a single (L, L) grid.
+        solutions : array_like, optional
+            The solutions of the grids, required if the file has a solution
+            column.
+        metadata
+            The values of the metadata columns, a scalar or N values each.
+            Missing columns are filled with zeros.
+
+        Returns
+        -------
+        None
+        """
+        grids = np.asarray(grids)
+        if grids.ndim == 2:
+            grids = grids[np.newaxis]
+        if grids.shape[1:] != (self.length, self.length):
+            raise ValueError(
+                f"The grids must be {self.length} x {self.length} arrays, "
+                f"not {grids.shape[1:]}."
+            )
+
+        records = np.zeros(len(grids), dtype=self.dtype)
+        records["grid"] = pack_grids(grids, self.bits)
+        if self.solution:
+            if solutions is None:
+                raise ValueError("The file requires the solutions of the grids.")
+            solutions = np.asarray(solutions).reshape(grids.shape)
+            records["solution"] = pack_grids(solutions, self.bits)
+        for name, values in metadata.items():
+            if name not in self.metadata:
+                raise ValueError(f"The file has no metadata column {name}.")
+            records[name] = values
+
+        self.file.write(records.tobytes())
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PuzzleReader:
+    """
+    Read a puzzle file through a memory map.
+
+    The records are never loaded all at once: the columns are views of the
+    mapped file and grids are unpacked only for the requested range.
+    """
+
+    def __init__(self, file_path: str):
+        """
+        Open a puzzle file.
+
+        Parameters
+        ----------
+        file_path : str
+        """
+        with open(file_path, "rb") as f:
+            header, header_size = read_header(f)
+
+        self.file_path = file_path
+        self.length = header["length"]
+        self.bits = header["bits"]
+        self.has_solution = header["solution"]
+        self.metadata = header["metadata"]
+        self.dtype = record_dtype(
+            self.length, self.bits, self.has_solution, self.metadata
+        )
+
+        count = (os.path.getsize(file_path) - header_size) // self.dtype.itemsize
+        if count:
+            self.records = np.memmap(
+                file_path, dtype=self.dtype, mode="r", offset=header_size, shape=count
+            )
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        if index < 0:
+            index += len(self)
+        return self.grids(index, index + 1)[0]
+
+    def grids(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """
+        Get a range of grids.
+
+        Parameters
+        ----------
+        start : int, optional
+        stop : int, optional
+
+        Returns
+        -------
+        np.ndarray
+            A (N, L, L) array of uint8. With 8 bits per cell it is a read-only
+            view of the file, otherwise the range is unpacked.
+        """
+        return unpack_grids(self.records["grid"][start:stop], self.length, self.bits)
+
+    def solutions(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """
+        Get the solutions of a range of grids.
+
+        Parameters
+        ----------
+        start : int, optional
+        stop : int, optional
+
+        Returns
+        -------
+        np.ndarray
+            A (N, L, L) array of uint8.
+        """
+        if not self.has_solution:
+            raise ValueError(f"The file {self.file_path} has no solution column.")
+        return unpack_grids(
+            self.records["solution"][start:stop], self.length, self.bits
+        )
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Get a metadata column, as a read-only view of the file.
+
+        Parameters
+        ----------
+        name : str
+
+        Returns
+        -------
+        np.ndarray
+        """
+        if name not in self.metadata:
+            raise ValueError(f"The file {self.file_path} has no column {name}.")
+        return self.records[name]
+
+    def iter_chunks(self, chunk_size: int = 4096):
+        """
+        Iterate over the grids by chunks, keeping the memory usage bounded.
+
+        Parameters
+        ----------
+        chunk_size : int, optional
+
+        Returns
+        -------
+        Iterator of np.ndarray
+            (N, L, L) arrays of at most `chunk_size` grids.
+        """
+        for start in range(0, len(self), chunk_size):
+            yield self.grids(start, start + chunk_size)
+
+    def __iter__(self):
+        for chunk in self.iter_chunks():
+            yield from chunk
+
+
+def is_grid_string(value: str) -> bool:
+    value = value.strip()
+    return bool(value) and all(ch in "0123456789." for ch in value)
+
+
+def read_puzzles(file_path: str, column: str = None):
+    """
+    Read the puzzles of a file lazily.
+
+    Parameters
+    ----------
+    file_path : str
+        A puzzle file, a CSV file or a text file with one grid per line.
+    column : str, optional
+        The column of the grids in a CSV file with a header. Defaults to the
+        first column.
+
+    Returns
+    -------
+    Iterator of str or np.ndarray
+        The grids, as strings for text files and as arrays for puzzle files.
+        Both are accepted by `parse_grid`.
+    """
+    with open(file_path, "rb") as f:
+        is_puzzle_file = f.read(len(MAGIC)) == MAGIC
+    if is_puzzle_file:
+        yield from PuzzleReader(file_path)
+        return
+
+    with open(file_path, newline="") as f:
+        if not file_path.endswith(".csv"):
+            for line in f:
+                if line.strip():
+                    yield line.strip()
+            return
+
+        rows = csv.reader(f)
+        header = next(rows, None)
+        if header is None:
+            return
+        index = header.index(column) if column is not None else 0
+        if column is None and is_grid_string(header[0]):
+            yield header[0].strip()
+        for row in rows:
+            if row:
+                yield row[index].strip()
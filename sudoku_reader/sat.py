@@ -0,0 +1,504 @@
+# -*- coding: utf-8 -*-
+"""SAT solving.
+
+This module encodes a SudokuCSP as a boolean satisfiability problem, one
+variable per cell and value, and solves it with a conflict-driven clause
+learning (CDCL) solver: two watched literals, VSIDS branching with phase
+saving, Luby restarts and learnt clause deletion.
+
+"""
+import heapq
+import math
+from collections.abc import Mapping
+
+from sudoku_reader.algorithms import SearchProgress, SearchStatistics, restart_cutoffs
+from sudoku_reader.csp import SudokuCSP
+
+
+class SATSolver:
+    """
+    A CDCL SAT solver.
+
+    Variables are numbered from 1 and a literal is a variable or its
+    negation, e.g. 3 or -3. The binary clauses, the most part of a sudoku
+    encoding, are kept as implication lists instead of watched clauses.
+    """
+
+    def __init__(
+        self, variable_count: int, restart_base: int = 100, decay: float = 0.95
+    ):
+        """
+        Create a SATSolver instance.
+
+        Parameters
+        ----------
+        variable_count : int
+            Number of variables.
+        restart_base : int, optional
+            Number of conflicts of the first run, the next ones following the
+            Luby sequence.
+        decay : float, optional
+            Decay of the variable activities at each conflict.
+        """
+        self.variable_count = variable_count
+        self.restart_base = restart_base
+        self.decay = decay
+
+        size = variable_count + 1
+        # 1 for true, -1 for false and 0 while unassigned.
+        self.values = [0] * size
+        self.levels = [0] * size
+        self.reasons = [None] * size
+        self.phases = [-1] * size
+        self.activity = [0.0] * size
+        self.seen = [False] * size
+        self.increment = 1.0
+        self.heap = [(0.0, var) for var in range(1, size)]
+
+        # Indexed by literals, the negative ones from the end of the lists.
+        self.implications = [list() for _ in range(2 * size)]
+        self.watches = [list() for _ in range(2 * size)]
+        self.learnts = list()
+        self.max_learnts = 2000
+
+        self.trail = list()
+        self.trail_limits = list()
+        self.head = 0
+        self.unsatisfiable = False
+
+    def value(self, literal: int) -> int:
+        value = self.values[abs(literal)]
+        return value if literal > 0 else -value
+
+    def add_clause(self, clause: list) -> bool:
+        """
+        Add a clause before solving.
+
+        Parameters
+        ----------
+        clause : list of int
+
+        Returns
+        -------
+        bool
+            False if the problem became unsatisfiable.
+        """
+        if self.unsatisfiable:
+            return False
+        literals = list()
+        for literal in dict.fromkeys(clause):
+            if -literal in literals or self.value(literal) == 1:
+                return True
+            if self.value(literal) == 0:
+                literals.append(literal)
+
+        if not literals:
+            self.unsatisfiable = True
+        elif len(literals) == 1:
+            self.enqueue(literals[0], None)
+            self.unsatisfiable = self.propagate() is not None
+        elif len(literals) == 2:
+            self.implications[literals[0]].append(literals[1])
+            self.implications[literals[1]].append(literals[0])
+        else:
+            self.watches[literals[0]].append(literals)
+            self.watches[literals[1]].append(literals)
+        return not self.unsatisfiable
+
+    def enqueue(self, literal: int, reason: list):
+        var = abs(literal)
+        self.values[var] = 1 if literal > 0 else -1
+        self.levels[var] = len(self.trail_limits)
+        self.reasons[var] = reason
+        self.trail.append(literal)
+
+    def propagate(self) -> list:
+        """
+        Propagate the assignments of the trail not propagated yet.
+
+        Returns
+        -------
+        list
+            The conflicting clause, or None.
+        """
+        values, trail = self.values, self.trail
+        while self.head < len(trail):
+            false_literal = -trail[self.head]
+            self.head += 1
+
+            for literal in self.implications[false_literal]:
+                value = values[literal] if literal > 0 else -values[-literal]
+                if value == -1:
+                    return [literal, false_literal]
+                if value == 0:
+                    self.enqueue(literal, [literal, false_literal])
+
+            # The first watched literal of a clause may become true, and the
+            # second one is the false literal.
+            watchers = self.watches[false_literal]
+            i = j = 0
+            count = len(watchers)
+            while i < count:
+                clause = watchers[i]
+                i += 1
+                if not clause:
+                    # Deleted learnt clause.
+                    continue
+                if clause[0] == false_literal:
+                    clause[0], clause[1] = clause[1], clause[0]
+                first = clause[0]
+                first_value = values[first] if first > 0 else -values[-first]
+                if first_value == 1:
+                    watchers[j] = clause
+                    j += 1
+                    continue
+
+                for k in range(2, len(clause)):
+                    literal = clause[k]
+                    if (values[literal] if literal > 0 else -values[-literal]) != -1:
+                        clause[1], clause[k] = literal, false_literal
+                        self.watches[literal].append(clause)
+                        break
+                else:
+                    watchers[j] = clause
+                    j += 1
+                    if first_value == -1:
+                        watchers[j:] = watchers[i:count]
+                        return clause
+                    self.enqueue(first, clause)
+            del watchers[j:]
+        return None
+
+    def analyze(self, conflict: list) -> tuple:
+        """
+        Learn a clause from a conflict, with the first unique implication
+        point.
+
+        Returns
+        -------
+        tuple of (list, int, int)
+            The learnt clause, its asserting literal first, the level to
+            backtrack to and the number of distinct levels of the clause.
+        """
+        levels, seen, trail = self.levels, self.seen, self.trail
+        level = len(self.trail_limits)
+        learnt = [0]
+        pending = 0
+        literal = 0
+        index = len(trail) - 1
+        clause = conflict
+
+        while True:
+            for other in clause:
+                var = abs(other)
+                if other == literal or seen[var] or not levels[var]:
+                    continue
+                seen[var] = True
+                self.bump(var)
+                if levels[var] == level:
+                    pending += 1
+                else:
+                    learnt.append(other)
+
+            while not seen[abs(trail[index])]:
+                index -= 1
+            literal = trail[index]
+            index -= 1
+            var = abs(literal)
+            seen[var] = False
+            pending -= 1
+            if not pending:
+                break
+            clause = self.reasons[var]
+
+        learnt[0] = -literal
+        for other in learnt[1:]:
+            seen[abs(other)] = False
+
+        backtrack_level = 0
+        if len(learnt) > 1:
+            # The literal of the highest level is watched with the asserting one.
+            deepest = max(range(1, len(learnt)), key=lambda k: levels[abs(learnt[k])])
+            learnt[1], learnt[deepest] = learnt[deepest], learnt[1]
+            backtrack_level = levels[abs(learnt[1])]
+        distinct_levels = len({levels[abs(other)] for other in learnt})
+        return learnt, backtrack_level, distinct_levels
+
+    def bump(self, var: int):
+        self.activity[var] += self.increment
+        if self.activity[var] > 1e100:
+            self.activity = [activity * 1e-100 for activity in self.activity]
+            self.increment *= 1e-100
+            self.rebuild()
+        elif not self.values[var]:
+            self.push(var)
+
+    def push(self, var: int):
+        # Outdated entries are skipped when branching, and dropped when the
+        # heap grows too large.
+        if len(self.heap) > 4 * self.variable_count:
+            self.rebuild()
+        heapq.heappush(self.heap, (-self.activity[var], var))
+
+    def rebuild(self):
+        self.heap = [
+            (-self.activity[var], var)
+            for var in range(1, self.variable_count + 1)
+            if not self.values[var]
+        ]
+        heapq.heapify(self.heap)
+
+    def pick_branching_variable(self) -> int:
+        heap = self.heap
+        while heap:
+            activity, var = heapq.heappop(heap)
+            if not self.values[var] and -activity == self.activity[var]:
+                return var
+        return 0
+
+    def backtrack(self, level: int):
+        if len(self.trail_limits) <= level:
+            return
+        limit = self.trail_limits[level]
+        for literal in self.trail[limit:]:
+            var = abs(literal)
+            self.phases[var] = self.values[var]
+            self.values[var] = 0
+            self.reasons[var] = None
+            self.push(var)
+        del self.trail[limit:]
+        del self.trail_limits[level:]
+        self.head = limit
+
+    def learn(self, learnt: list, distinct_levels: int):
+        if len(learnt) == 1:
+            self.enqueue(learnt[0], None)
+            return
+        if len(learnt) == 2:
+            self.implications[learnt[0]].append(learnt[1])
+            self.implications[learnt[1]].append(learnt[0])
+        else:
+            self.watches[learnt[0]].append(learnt)
+            self.watches[learnt[1]].append(learnt)
+            self.learnts.append((distinct_levels, learnt))
+        self.enqueue(learnt[0], learnt)
+
+    def reduce_learnts(self):
+        """
+        Delete half of the learnt clauses, those spanning the most levels
+        first. The clauses spanning two levels or less, and the reasons of
+        the current assignments, are kept.
+        """
+
+        def is_reason(clause):
+            return self.reasons[abs(clause[0])] is clause
+
+        self.learnts.sort(key=lambda learnt: learnt[0])
+        half = len(self.learnts) // 2
+        kept = self.learnts[:half]
+        for distinct_levels, clause in self.learnts[half:]:
+            if distinct_levels <= 2 or is_reason(clause):
+                kept.append((distinct_levels, clause))
+            else:
+                # Removed from the watch lists when they are next visited.
+                clause.clear()
+        self.learnts = kept
+        self.max_learnts = int(self.max_learnts * 1.1)
+
+    def search(
+        self, max_conflicts: int, statistics: SearchStatistics, progress: callable
+    ):
+        """
+        Run the search until a result or a number of conflicts.
+
+        Returns
+        -------
+        bool or None if the search must restart.
+        """
+        conflicts = 0
+        while True:
+            conflict = self.propagate()
+            if conflict is not None:
+                conflicts += 1
+                statistics.backtracks += 1
+                if not self.trail_limits:
+                    return False
+                learnt, level, distinct_levels = self.analyze(conflict)
+                if len(self.trail_limits) - level > 1:
+                    statistics.backjumps += 1
+                self.backtrack(level)
+                self.learn(learnt, distinct_levels)
+                self.increment /= self.decay
+                continue
+
+            if conflicts >= max_conflicts:
+                self.backtrack(0)
+                return None
+            if len(self.learnts) >= self.max_learnts:
+                self.reduce_learnts()
+
+            var = self.pick_branching_variable()
+            if not var:
+                return True
+            statistics.nodes += 1
+            self.trail_limits.append(len(self.trail))
+            self.enqueue(var if self.phases[var] > 0 else -var, None)
+            if progress is not None:
+                progress()
+
+    def solve(self, statistics: SearchStatistics = None, progress: callable = None):
+        """
+        Solve the problem.
+
+        Parameters
+        ----------
+        statistics : SearchStatistics, optional
+            Counters to fill: the decisions as nodes, the conflicts as
+            backtracks, the non-chronological backtracks as backjumps, and
+            the restarts.
+        progress : callable, optional
+            Called after each decision.
+
+        Returns
+        -------
+        bool
+            True if the problem is satisfiable, its model being in `values`.
+        """
+        statistics = statistics if statistics is not None else SearchStatistics()
+        if self.unsatisfiable or self.propagate() is not None:
+            self.unsatisfiable = True
+            return False
+
+        for max_conflicts in restart_cutoffs("luby", self.restart_base):
+            result = self.search(max_conflicts, statistics, progress)
+            if result is not None:
+                self.unsatisfiable = not result
+                return result
+            statistics.restarts += 1
+
+
+class SATAssignment(Mapping):
+    """
+    The CSP assignment read from the current values of a SAT encoding, only
+    decoded when accessed.
+    """
+
+    def __init__(self, solver: SATSolver, variables: list, length: int):
+        self.solver = solver
+        self.variables = variables
+        self.length = length
+        self.index = {var: i for i, var in enumerate(variables)}
+
+    def __getitem__(self, var):
+        first = self.index[var] * self.length
+        values = self.solver.values
+        for value in range(1, self.length + 1):
+            if values[first + value] == 1:
+                return value
+        raise KeyError(var)
+
+    def __iter__(self):
+        return (var for var in self.variables if var in self)
+
+    def __contains__(self, var):
+        try:
+            self[var]
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def encode_sudoku(csp: SudokuCSP) -> SATSolver:
+    """
+    Encode a SudokuCSP in a SAT solver.
+
+    The variable of the value v (from 1) of the i-th CSP variable is
+    i * N + v. Each cell has at least one and at most one value of its
+    domain, two cells of a constraint don't have the same value, and each
+    value is somewhere in each row, column and box.
+
+    Parameters
+    ----------
+    csp : SudokuCSP
+
+    Returns
+    -------
+    SATSolver
+    """
+    length = len(csp.sudoku_map)
+    size = round(math.sqrt(length))
+    index = {var: i for i, var in enumerate(csp.variables)}
+    solver = SATSolver(len(csp.variables) * length)
+
+    def literal(var, value):
+        return index[var] * length + int(value)
+
+    for var in csp.variables:
+        domain = sorted(int(value) for value in csp.domains[var])
+        solver.add_clause([literal(var, value) for value in domain])
+        for value in range(1, length + 1):
+            if value not in domain:
+                solver.add_clause([-literal(var, value)])
+        for k, value in enumerate(domain):
+            for other in domain[k + 1 :]:
+                solver.add_clause([-literal(var, value), -literal(var, other)])
+
+    for constraint in csp.constraints:
+        var, other = constraint.scope
+        for value in csp.domains[var] & csp.domains[other]:
+            solver.add_clause([-literal(var, value), -literal(other, value)])
+
+    units = list()
+    for k in range(length):
+        units.append([(k, y) for y in range(length)])
+        units.append([(x, k) for x in range(length)])
+        x_box, y_box = size * (k // size), size * (k % size)
+        units.append([(x_box + i, y_box + j) for i in range(size) for j in range(size)])
+    for unit in units:
+        for value in range(1, length + 1):
+            solver.add_clause(
+                [
+                    literal(f"{x}, {y}", value)
+                    for x, y in unit
+                    if value in csp.domains[f"{x}, {y}"]
+                ]
+            )
+    return solver
+
+
+def solve_sat(
+    csp: SudokuCSP,
+    statistics: SearchStatistics = None,
+    progress: SearchProgress = None,
+) -> dict:
+    """
+    Solve a SudokuCSP with the CDCL solver.
+
+    Parameters
+    ----------
+    csp : SudokuCSP
+    statistics : SearchStatistics, optional
+        Counters to fill during the search.
+    progress : SearchProgress, optional
+        Receives snapshots of the search.
+
+    Returns
+    -------
+    dict
+        The complete assignment, or None if there is no solution.
+    """
+    solver = encode_sudoku(csp)
+    assignment = SATAssignment(solver, csp.variables, len(csp.sudoku_map))
+    on_decision = None
+    if progress is not None:
+        progress.start(csp, csp.apply_constraints())
+
+        def on_decision():
+            progress.update(assignment)
+
+    if not solver.solve(statistics, on_decision):
+        return None
+    return dict(assignment)
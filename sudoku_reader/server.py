@@ -2,80 +2,325 @@
 Flask application.
 """
 import traceback
-import skimage.io
 try:
 
+    import json
     import os
-    from werkzeug.utils import secure_filename
+    import threading
+    import time
 
-    from flask import Flask, request, abort
+    from flask import Flask, Response, request, abort, jsonify, stream_with_context
     import matplotlib.pyplot as plt
     import numpy as np
 
-    from sudoku_reader.algorithms import AC3, backtracking_search
-    from sudoku_reader.csp import SudokuCSP
-    from sudoku_reader.digits import filter_cells, predict_digit_from_picture
+    from sudoku_reader.algorithms import SearchStatistics, solve_cells, solve_sudoku
+    from sudoku_reader.csp import is_consistent_map
+    from sudoku_reader.interfaces import AlgorithmType
+    from sudoku_reader.jobs import JobQueue, JobStatus, QueueFullError
+    from sudoku_reader.portfolio import PORTFOLIO, solve_portfolio
+    from sudoku_reader.puzzles import format_grid, parse_grid
+    from sudoku_reader.digits import (
+        DIGIT_CACHE,
+        DigitBatcher,
+        predict_digit_probabilities,
+    )
+    from sudoku_reader.metrics import REGISTRY, Trace
     from sudoku_reader.picture import (
-        binarize,
-        binary_dilatation,
-        get_largest_connected_components,
-        get_highest_spikes,
-        filter_digit_pictures,
-        create_grid_picture,
-        perspective_transform,
+        encode_grid_picture,
+        extract_digit_pictures,
+        filter_cells,
+        read_cells,
     )
 except Exception:
     print(traceback.format_exc())
 
 app = Flask(__name__)
 
+job_queue = None
+job_queue_lock = threading.Lock()
+digit_batcher = DigitBatcher()
+
+# Maximum time in seconds given to a portfolio of strategies.
+PORTFOLIO_TIMEOUT = 30.0
+# Maximum number of portfolios solved at once, as each one starts a process
+# per strategy.
+MAX_PORTFOLIOS = max(1, (os.cpu_count() or 1) // len(PORTFOLIO))
+portfolio_slots = threading.BoundedSemaphore(MAX_PORTFOLIOS)
+
+SOLVE_FAILURES = REGISTRY.counter(
+    "sudoku_solve_failures_total", "Grids without any solution, by source."
+)
+FALLBACKS = REGISTRY.counter(
+    "sudoku_fallbacks_total", "Pictures answered with their unsolved grid."
+)
+JOB_ERRORS = REGISTRY.counter(
+    "sudoku_job_errors_total", "Failed picture jobs, by exception type."
+)
+REJECTED_JOBS = REGISTRY.counter(
+    "sudoku_rejected_jobs_total", "Picture jobs refused because the queue was full."
+)
+SOLVE_SECONDS = REGISTRY.histogram(
+    "sudoku_api_solve_seconds", "Time spent solving the grids of the JSON API."
+)
+
+
+def collect_runtime_metrics() -> list:
+    lines = [
+        "# TYPE sudoku_digit_cache_hits_total counter",
+        f"sudoku_digit_cache_hits_total {DIGIT_CACHE.hits}",
+        "# TYPE sudoku_digit_cache_misses_total counter",
+        f"sudoku_digit_cache_misses_total {DIGIT_CACHE.misses}",
+        "# TYPE sudoku_classification_batches_total counter",
+        f"sudoku_classification_batches_total {digit_batcher.batches}",
+    ]
+    if job_queue is not None:
+        lines += [
+            "# TYPE sudoku_pending_jobs gauge",
+            f"sudoku_pending_jobs {job_queue.pending_count()}",
+        ]
+    return lines
 
-@app.route("/resolve", methods=["POST"])
-def upload_file():
 
+REGISTRY.add_collector(collect_runtime_metrics)
+
+
+def get_job_queue() -> JobQueue:
+    global job_queue
+    with job_queue_lock:
+        if job_queue is None:
+            job_queue = JobQueue()
+        return job_queue
+
+
+def read_uploaded_picture() -> bytes:
     f = request.files["image"]
-    filename = os.path.join("../storage", secure_filename(f.filename))
-    extension = os.path.splitext(filename)[1]
+    extension = os.path.splitext(f.filename)[1].lower()
 
     if extension != ".png" and extension != ".jpg" and extension != ".jpeg":
         abort(422)
 
-    f.save(filename)
+    return f.read()
 
-    picture = skimage.io.imread(filename)
-    digits = get_grid(picture)
 
-    create_grid_picture(digits, "static/img/return.png")
-    return "/static/img/return.png"
+@app.route("/resolve", methods=["POST"])
+def upload_file():
+    data = read_uploaded_picture()
+    trace = Trace()
 
+    try:
+        job = get_job_queue().submit(resolve_picture, data, trace)
+    except QueueFullError:
+        REJECTED_JOBS.inc()
+        abort(503)
+
+    try:
+        digits = job.result()
+    except TimeoutError:
+        JOB_ERRORS.inc(error="TimeoutError")
+        abort(504)
+    except ValueError as e:
+        return jsonify(error=str(e)), 422
+    except Exception as e:
+        # Already counted by resolve_picture.
+        return jsonify(error=f"{type(e).__name__}: {e}"), 500
+
+    response_format = request.args.get("format", "png").lower()
+    if response_format == "json":
+        response = {"grid": [int(digit) for digit in digits]}
+        if request.args.get("trace"):
+            response["trace"] = trace.as_dict()
+        response = jsonify(response)
+    else:
+        with trace.stage("render"):
+            picture = encode_grid_picture(digits, image_format=response_format)
+        trace.observe()
+        mimetype = "image/webp" if response_format == "webp" else "image/png"
+        response = Response(picture, mimetype=mimetype)
+
+    response.headers["Server-Timing"] = trace.server_timing()
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    data = read_uploaded_picture()
+
+    try:
+        job = get_job_queue().submit(resolve_picture, data)
+    except QueueFullError:
+        REJECTED_JOBS.inc()
+        return jsonify(error="Too many pending jobs, retry later."), 503
+    return jsonify(job.as_dict()), 202
 
-def get_grid(picture: np.array):
-    picture = binarize(picture)
 
-    bin_picture = binary_dilatation(picture)
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id: str):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        abort(404)
 
-    bin_picture = perspective_transform(bin_picture)
+    wait = request.args.get("wait", type=float)
+    if wait:
+        try:
+            job.result(timeout=wait)
+        except Exception:
+            # The failure or the timeout is reported by the job status.
+            pass
 
-    grid_picture = get_largest_connected_components(bin_picture)
+    response = job.as_dict()
+    if job.status is JobStatus.DONE:
+        response["grid"] = job.result()
+    return jsonify(response)
 
-    x_proj = get_highest_spikes(grid_picture, n=10, axis=0)
-    y_proj = get_highest_spikes(grid_picture, n=10, axis=1)
 
-    digits = filter_digit_pictures(bin_picture, y_proj, x_proj)
+def resolve_picture(data: bytes, trace: Trace = None) -> list:
+    """
+    Read and solve the grid of an encoded picture. Executed in a job thread.
+
+    The picture treatment and the solving run in worker processes, while the
+    digits are classified in this process, batched with the other jobs.
+
+    Parameters
+    ----------
+    data : bytes
+    trace : Trace, optional
+        Trace where the stages are timed.
+
+    Returns
+    -------
+    list of int
+    """
+    trace = trace or Trace()
+    queue = get_job_queue()
+    try:
+        cells, stages = queue.run_in_worker(read_cells, data)
+        trace.extend(stages)
+
+        with trace.stage("classification"):
+            probabilities = digit_batcher.predict(cells)
+
+        digits, solved, stages = queue.run_in_worker(solve_cells, probabilities)
+        trace.extend(stages)
+    except Exception as e:
+        JOB_ERRORS.inc(error=type(e).__name__)
+        raise
+    finally:
+        trace.observe()
+
+    if not solved:
+        SOLVE_FAILURES.inc(source="picture")
+        FALLBACKS.inc()
+    return digits
+
+
+def get_grid(picture: np.array):
+    digits = extract_digit_pictures(picture)
 
     digits = filter_cells(digits)
-    print(digits[1][1])
-    prediction = predict_digit_from_picture(digits)
+    probabilities = predict_digit_probabilities(digits)
+
+    digits, _, _ = solve_cells(probabilities)
+    return np.array(digits)
+
+
+def parse_algorithm(name: str) -> AlgorithmType:
+    for algorithm_type in AlgorithmType:
+        if name in (algorithm_type.name, algorithm_type.value):
+            return algorithm_type
+    raise ValueError(f"Unknown algorithm {name}.")
 
-    grid = np.zeros((9, 9), dtype=int)
-    for (x, y), ch in prediction:
-        grid[x, y] = ch
 
+def solve_grid(value, algorithm_type: AlgorithmType) -> dict:
+    """
+    Solve a grid and format the result in the same representation.
+
+    Parameters
+    ----------
+    value : str or list
+    algorithm_type : AlgorithmType
+
+    Returns
+    -------
+    dict
+    """
+    sudoku_map = parse_grid(value)
+    statistics = SearchStatistics()
+    result = {"algorithm": algorithm_type.name}
+
+    start = time.perf_counter()
+    if algorithm_type is AlgorithmType.PORTFOLIO and is_consistent_map(sudoku_map):
+        if not portfolio_slots.acquire(timeout=PORTFOLIO_TIMEOUT):
+            raise TimeoutError("Too many grids are being solved by a portfolio.")
+        try:
+            solution, winner, search_statistics = solve_portfolio(
+                sudoku_map, timeout=PORTFOLIO_TIMEOUT
+            )
+        finally:
+            portfolio_slots.release()
+        for name, count in search_statistics.items():
+            setattr(statistics, name, count)
+        result["winner"] = winner.name
+    else:
+        solution = solve_sudoku(sudoku_map, algorithm_type, statistics)
+    elapsed = time.perf_counter() - start
+
+    SOLVE_SECONDS.observe(elapsed, algorithm=algorithm_type.name)
+    if solution is None:
+        SOLVE_FAILURES.inc(source="api")
+
+    if solution is not None and isinstance(value, str):
+        solution = format_grid(solution)
+    elif solution is not None:
+        solution = solution.tolist()
+
+    return {
+        "solution": solution,
+        **result,
+        "time": elapsed,
+        **statistics.as_dict(),
+    }
+
+
+@app.route("/solve", methods=["POST"])
+def solve():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify(error="A JSON object is expected."), 400
+    try:
+        algorithm_type = parse_algorithm(body.get("algorithm", "AC3"))
+        return jsonify(solve_grid(body["grid"], algorithm_type))
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    except TimeoutError as e:
+        return jsonify(error=str(e)), 504
+    except RuntimeError as e:
+        return jsonify(error=str(e)), 500
+
+
+@app.route("/solve/batch", methods=["POST"])
+def solve_batch():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify(error="A JSON object is expected."), 400
+    grids = body.get("grids")
+    if not isinstance(grids, list):
+        return jsonify(error="A list of grids is expected."), 400
     try:
-        csp = SudokuCSP(grid)
-        csp = AC3(csp)
-        assignment = backtracking_search(csp)
+        algorithm_type = parse_algorithm(body.get("algorithm", "AC3"))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    def generate():
+        for index, value in enumerate(grids):
+            try:
+                result = {"index": index, **solve_grid(value, algorithm_type)}
+            except (TypeError, ValueError, TimeoutError, RuntimeError) as e:
+                result = {"index": index, "error": str(e)}
+            yield json.dumps(result) + "\n"
 
-        return csp.get_resulted_map(assignment).flatten()
-    except Exception:
-        return grid.flatten()
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Streaming solving.
+
+This module solves a stream of puzzles in a pool of worker processes. Only a
+bounded number of puzzles are read ahead, and the results are yielded in the
+order of the puzzles, so that files of any size are solved with a constant
+memory usage.
+
+"""
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from sudoku_reader.algorithms import solve_sudoku
+from sudoku_reader.interfaces import AlgorithmType
+from sudoku_reader.puzzles import parse_grid, read_puzzles
+
+
+def solve_chunk(puzzles: list, algorithm_type: AlgorithmType) -> list:
+    """
+    Solve a chunk of puzzles. Executed in a worker process.
+
+    Parameters
+    ----------
+    puzzles : list
+        Grids accepted by `parse_grid`.
+    algorithm_type : AlgorithmType
+
+    Returns
+    -------
+    list of dict
+        For each puzzle, its parsed grid, its solution (None if it has no
+        solution), the solving time in seconds and an error message (empty if
+        the puzzle is valid).
+    """
+    results = list()
+    for puzzle in puzzles:
+        start = time.perf_counter()
+        result = {"grid": None, "solution": None, "time": 0.0, "error": ""}
+        try:
+            result["grid"] = parse_grid(puzzle)
+            result["solution"] = solve_sudoku(result["grid"], algorithm_type)
+        except ValueError as e:
+            result["error"] = str(e)
+        except Exception as e:
+            # Any failure is kept to its puzzle instead of losing the chunk.
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["time"] = time.perf_counter() - start
+        results.append(result)
+    return results
+
+
+def solve_stream(
+    puzzles,
+    algorithm_type: AlgorithmType = AlgorithmType.AC3,
+    workers: int = None,
+    chunk_size: int = 64,
+    max_pending: int = None,
+):
+    """
+    Solve a stream of puzzles.
+
+    Parameters
+    ----------
+    puzzles : iterable
+        Grids accepted by `parse_grid`, read lazily.
+    algorithm_type : AlgorithmType, optional
+    workers : int, optional
+        Number of worker processes. Defaults to the number of CPUs. With 0,
+        the puzzles are solved in the calling process.
+    chunk_size : int, optional
+        Number of puzzles sent at once to a worker.
+    max_pending : int, optional
+        Maximum number of chunks being solved or waiting to be yielded.
+        Defaults to twice the number of workers.
+
+    Returns
+    -------
+    Iterator of dict
+        The results of `solve_chunk`, in the order of the puzzles.
+    """
+    puzzles = iter(puzzles)
+    chunks = iter(lambda: list(islice(puzzles, chunk_size)), [])
+
+    workers = os.cpu_count() if workers is None else workers
+    if workers == 0:
+        for chunk in chunks:
+            yield from solve_chunk(chunk, algorithm_type)
+        return
+
+    max_pending = max_pending or 2 * workers
+    executor = ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    )
+    pending = deque()
+    try:
+        for chunk in chunks:
+            pending.append(executor.submit(solve_chunk, chunk, algorithm_type))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        # Stop reading ahead if the stream is closed before its end.
+        for future in pending:
+            future.cancel()
+        executor.shutdown()
+
+
+def solve_file(file_path: str, column: str = None, **kwargs):
+    """
+    Solve the puzzles of a file, see `read_puzzles` and `solve_stream`.
+
+    Parameters
+    ----------
+    file_path : str
+    column : str, optional
+    kwargs
+        Keyword arguments of `solve_stream`.
+
+    Returns
+    -------
+    Iterator of dict
+    """
+    return solve_stream(read_puzzles(file_path, column), **kwargs)
@@ -0,0 +1,285 @@
+"""
+Video stream module.
+"""
+import sys
+
+import numpy as np
+import cv2
+
+from sudoku_reader.picture import (
+    BinarizationMethod,
+    binarize,
+    binary_dilatation,
+    downscale,
+    filter_cells,
+    filter_digit_pictures,
+    get_grid_lines,
+    locate_grid,
+    to_grey,
+    warp_grid,
+)
+from sudoku_reader.digits import predict_digit_from_picture
+
+
+def read_frames(source):
+    """
+    Read the frames of a video file or a camera.
+
+    Parameters
+    ----------
+    source : str or int
+        Path of a video file or index of a camera.
+
+    Returns
+    -------
+    Generator of N x M x 3 RGB matrices.
+    """
+    capture = cv2.VideoCapture(source)
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    finally:
+        capture.release()
+
+
+class GridTracker:
+    """
+    Read a sudoku grid from consecutive frames.
+
+    The grid is detected on the first frame where it is found, then its corners
+    are tracked with optical flow. Only the cells whose picture changed since
+    the previous frame are classified again.
+    """
+
+    def __init__(
+        self,
+        detection_size: int = 640,
+        warp_size: int = 900,
+        redetect_every: int = 0,
+        change_threshold: float = 0.2,
+    ):
+        """
+        Create a GridTracker instance.
+
+        Parameters
+        ----------
+        detection_size : int, optional
+            Largest side of the levels used for detection and tracking.
+        warp_size : int, optional
+            Largest side of the warped grid picture.
+        redetect_every : int, optional
+            Run a full detection every `redetect_every` frames even when the
+            grid is tracked. 0 disables it.
+        change_threshold : float, optional
+            Fraction of differing pixels above which a cell is classified again.
+        """
+        self.detection_size = detection_size
+        self.warp_size = warp_size
+        self.redetect_every = redetect_every
+        self.change_threshold = change_threshold
+
+        self.detections = 0
+        self.classified_cells = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the locked grid.
+
+        Returns
+        -------
+        None
+        """
+        self.corners = None
+        self.previous_level = None
+        self.frames_since_detection = 0
+        self.size = None
+        self.rows = None
+        self.cols = None
+        self.cells = dict()
+        self.grid = np.zeros((9, 9), dtype=int)
+
+    @property
+    def locked(self) -> bool:
+        return self.corners is not None
+
+    def track_corners(self, level: np.ndarray, scale: float):
+        """
+        Follow the grid corners from the previous level to the given one.
+
+        Parameters
+        ----------
+        level : np.ndarray
+            Downsampled grey frame.
+        scale : float
+            Scale factor of the level.
+
+        Returns
+        -------
+        4 x 2 matrix of corners, or None if the grid is lost.
+        """
+        points = (self.corners * scale).reshape(-1, 1, 2).astype(np.float32)
+        tracked, status, _ = cv2.calcOpticalFlowPyrLK(
+            self.previous_level, level, points, None, winSize=(21, 21), maxLevel=3
+        )
+        if tracked is None or not status.all():
+            return None
+
+        tracked = tracked.reshape(4, 2)
+        previous_area = cv2.contourArea(points.reshape(4, 2))
+        area = cv2.contourArea(tracked)
+        if not cv2.isContourConvex(tracked) or not (
+            0.5 * previous_area < area < 2 * previous_area
+        ):
+            return None
+        return tracked / scale
+
+    def warp(self, grey_img: np.ndarray, **options) -> np.ndarray:
+        """
+        Warp the grid of a grey frame and binarize it.
+
+        Parameters
+        ----------
+        grey_img : np.ndarray
+            Grey frame.
+        options
+            Passed to `warp_grid`.
+
+        Returns
+        -------
+        The dilated warped grid picture.
+        """
+        warped = warp_grid(grey_img, self.corners, **options)
+        return binary_dilatation(binarize(warped, method=BinarizationMethod.OPENCV))
+
+    def detect(self, grey_img: np.ndarray) -> np.ndarray:
+        """
+        Run a full detection of the grid.
+
+        Parameters
+        ----------
+        grey_img : np.ndarray
+            Grey frame.
+
+        Returns
+        -------
+        The dilated warped grid picture.
+        """
+        # Only the detection level is binarized to find the contour.
+        bin_level = binarize(
+            grey_img, method=BinarizationMethod.OPENCV, max_size=self.detection_size
+        )
+        scale = bin_level.shape[1] / grey_img.shape[1]
+        self.corners = locate_grid(bin_level, self.detection_size) / scale
+        warped = self.warp(grey_img, max_size=self.warp_size)
+
+        rows, cols = get_grid_lines(warped, self.detection_size)
+        if len(rows) != 10 or len(cols) != 10:
+            raise ValueError("The grid lines couldn't be found.")
+
+        self.size = (warped.shape[1], warped.shape[0])
+        self.rows, self.cols = rows, cols
+        self.frames_since_detection = 0
+        self.detections += 1
+        return warped
+
+    def cell_changed(self, position: tuple, cell: np.ndarray) -> bool:
+        previous = self.cells.get(position)
+        if previous is None:
+            return True
+        union = np.count_nonzero(previous | cell)
+        return np.count_nonzero(previous != cell) > self.change_threshold * max(
+            union, 1
+        )
+
+    def process(self, frame: np.ndarray):
+        """
+        Read the grid of a frame.
+
+        Parameters
+        ----------
+        frame : np.ndarray
+            A N x M x 3 RGB matrix.
+
+        Returns
+        -------
+        9 x 9 matrix of digits (empty => 0), or None if no grid is found.
+        """
+        grey_img = to_grey(frame)
+        level, scale = downscale(grey_img, self.detection_size)
+
+        corners = None
+        if self.locked and (
+            not self.redetect_every or self.frames_since_detection < self.redetect_every
+        ):
+            corners = self.track_corners(level, scale)
+        self.previous_level = level
+
+        try:
+            if corners is None:
+                warped = self.detect(grey_img)
+            else:
+                self.corners = corners
+                self.frames_since_detection += 1
+                warped = self.warp(grey_img, size=self.size)
+        except ValueError:
+            self.reset()
+            return None
+
+        cells = filter_cells(filter_digit_pictures(warped, self.rows, self.cols))
+        positions = {tuple(position) for position, _ in cells}
+
+        for position in list(self.cells):
+            if position not in positions:
+                self.cells.pop(position)
+                self.grid[position] = 0
+
+        changed = [
+            [position, cell]
+            for position, cell in cells
+            if self.cell_changed(tuple(position), cell)
+        ]
+        for position, cell in changed:
+            self.cells[tuple(position)] = cell
+
+        if changed:
+            self.classified_cells += len(changed)
+            for position, digit in predict_digit_from_picture(changed):
+                self.grid[tuple(position)] = digit
+
+        return self.grid.copy()
+
+
+def read_grids(frames, tracker: GridTracker = None):
+    """
+    Read the grid of each frame of a stream.
+
+    Parameters
+    ----------
+    frames : iterable of np.ndarray
+        RGB frames, for example from `read_frames`.
+    tracker : GridTracker, optional
+
+    Returns
+    -------
+    Generator of 9 x 9 matrices, or None for the frames without a grid.
+    """
+    tracker = tracker or GridTracker()
+    for frame in frames:
+        yield tracker.process(frame)
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else 0
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+
+    last_grid = None
+    for index, grid in enumerate(read_grids(read_frames(source))):
+        if grid is not None and (last_grid is None or (grid != last_grid).any()):
+            print(f"Frame {index}:")
+            print(grid)
+        last_grid = grid